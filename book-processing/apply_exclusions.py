@@ -6,13 +6,24 @@ This script reads exclusions.json and filters out books from:
 - library_with_embeddings.json
 - galaxy_coordinates.json  
 - analytics_data.json (recalculated based on filtered books)
+- library.parquet, the embeddings sidecar and galaxy_coords.npz, when present
+  (library.parquet or the embeddings sidecar is deleted instead if older than the JSON)
 
 Run this AFTER the main pipeline and BEFORE copying to public/data/
 """
 import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from collections import Counter
 
+import ijson
+import numpy as np
+import orjson
+import pandas as pd
+
 # --- CONFIGURATION ---
 SCRIPT_DIR = Path(__file__).parent
 DATA_DIR = SCRIPT_DIR.parent / 'data'
@@ -23,6 +34,25 @@ LIBRARY_FILE = DATA_DIR / 'library_with_embeddings.json'
 GALAXY_FILE = DATA_DIR / 'galaxy_coordinates.json'
 ANALYTICS_FILE = DATA_DIR / 'analytics_data.json'
 
+# Optional binary embeddings sidecar (written by generate_embeddings_v2.py):
+# int8 unit vectors + fp16 norms, row order given by the ids file
+EMBEDDINGS_FILE = DATA_DIR / 'library_embeddings.npy'
+EMBEDDING_NORMS_FILE = DATA_DIR / 'library_embedding_norms.npy'
+EMBEDDING_IDS_FILE = DATA_DIR / 'library_embedding_ids.json'
+# Optional columnar metadata (same writer); embedding_row points into EMBEDDINGS_FILE
+LIBRARY_PARQUET_FILE = DATA_DIR / 'library.parquet'
+# Optional float32 galaxy coordinates (written by precompute_analytics_v2.py)
+GALAXY_COORDS_FILE = DATA_DIR / 'galaxy_coords.npz'
+
+# Buffer size for streamed JSON output (fewer, larger write() calls)
+WRITE_BUFFER_SIZE = 1 << 20
+
+# Maps YYYY/MM -> YYYY-MM for the reading timeline in a single C call
+SLASH_TO_DASH = str.maketrans('/', '-')
+
+# Fields kept in memory per book for reporting and analytics
+SUMMARY_FIELDS = ('id', 'title', 'author', 'is_read', 'my_rating', 'date_read')
+
 
 def load_exclusions():
     """Load exclusion rules from config file."""
@@ -47,104 +77,270 @@ def load_exclusions():
         return json.load(f)
 
 
-def should_exclude(book, exclusions):
-    """Check if a book should be excluded based on rules and lists."""
+def make_excluder(exclusions):
+    """Build a should_exclude(book) check with rules and lookup sets pre-resolved.
+    
+    Flags and sets are captured as closure locals so the per-book check does
+    no config lookups.
+    """
     rules = exclusions.get('rules', {})
-    exclude_titles = [t.lower() for t in exclusions.get('exclude_titles', [])]
-    exclude_authors = [a.lower() for a in exclusions.get('exclude_authors', [])]
-    exclude_ids = exclusions.get('exclude_ids', [])
+    excl_no_date = rules.get('exclude_no_date_read', False)
+    excl_one_star = rules.get('exclude_one_star', False)
+    excl_unread = rules.get('exclude_unread', False)
+    titles = frozenset(t.casefold() for t in exclusions.get('exclude_titles', []))
+    authors = frozenset(a.casefold() for a in exclusions.get('exclude_authors', []))
+    ids = frozenset(exclusions.get('exclude_ids', []))
     
-    # Rule: exclude books without date_read (for read books only)
-    if rules.get('exclude_no_date_read', False):
-        if book.get('is_read', False) and not book.get('date_read'):
+    def should_exclude(book):
+        """Return (exclude, reason) for a book."""
+        get = book.get
+        is_read = get('is_read', False)
+        
+        # Rule: exclude books without date_read (for read books only)
+        if excl_no_date and is_read and not get('date_read'):
             return True, "no_date_read"
-    
-    # Rule: exclude 1-star books
-    if rules.get('exclude_one_star', False):
-        if book.get('my_rating') == 1:
+        
+        # Rule: exclude 1-star books
+        if excl_one_star and get('my_rating') == 1:
             return True, "one_star"
-    
-    # Rule: exclude all unread books
-    if rules.get('exclude_unread', False):
-        if not book.get('is_read', False):
+        
+        # Rule: exclude all unread books
+        if excl_unread and not is_read:
             return True, "unread"
+        
+        # Specific title exclusions (casefold for Unicode-aware matching)
+        if get('title', '').casefold() in titles:
+            return True, "title_list"
+        
+        # Specific author exclusions
+        if get('author', '').casefold() in authors:
+            return True, "author_list"
+        
+        # Specific ID exclusions
+        if get('id', '') in ids:
+            return True, "id_list"
+        
+        return False, None
     
-    # Specific title exclusions
-    if book.get('title', '').lower() in exclude_titles:
-        return True, "title_list"
+    return should_exclude
+
+
+def atomic_write(path, data):
+    """Write bytes to a temp file next to `path`, then atomically replace it."""
+    tmp_file = path.with_name(path.name + '.tmp')
+    tmp_file.write_bytes(data)
+    os.replace(tmp_file, path)
+
+
+@contextmanager
+def json_array_writer(path):
+    """Stream items into a JSON array file, one compact item per line.
     
-    # Specific author exclusions
-    if book.get('author', '').lower() in exclude_authors:
-        return True, "author_list"
+    Yields a write(item) function. Output goes to a temp file behind a large
+    buffer and only replaces `path` once the array is complete.
+    """
+    tmp_file = path.with_name(path.name + '.tmp')
+    try:
+        with open(tmp_file, 'wb', buffering=WRITE_BUFFER_SIZE) as out:
+            separator = b'\n'
+            
+            def write(item):
+                nonlocal separator
+                out.write(separator)
+                out.write(orjson.dumps(item))
+                separator = b',\n'
+            
+            out.write(b'[')
+            yield write
+            out.write(b'\n]\n')
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_file, path)
+
+
+def parse_genres(genres):
+    """Decode a genres field (JSON string or list) into a list."""
+    if isinstance(genres, str):
+        try:
+            return orjson.loads(genres)
+        except orjson.JSONDecodeError:
+            return []
+    return genres or []
+
+
+def summarize_book(book):
+    """Keep only the lightweight fields of a book (drops embedding and description text).
     
-    # Specific ID exclusions
-    if book.get('id', '') in exclude_ids:
-        return True, "id_list"
+    Genres are decoded once here into '_genres' so analytics never re-parses them,
+    and only the description length is kept since that is all analytics needs.
+    Author and genre strings are interned so repeated Counter keys share one object.
+    """
+    summary = {k: book[k] for k in SUMMARY_FIELDS if k in book}
+    if isinstance(summary.get('author'), str):
+        summary['author'] = sys.intern(summary['author'])
+    summary['_genres'] = [sys.intern(g) if isinstance(g, str) else g
+                          for g in parse_genres(book.get('genres', '[]'))]
+    summary['_description_len'] = len(book.get('description') or '')
+    return summary
+
+
+def remove_stale_sidecars():
+    """Delete sidecars older than the library JSON, before the JSON is rewritten.
     
-    return False, None
+    Filtering a stale sidecar would leave it newer than the JSON, so readers would
+    take it as current. Returns the removed paths.
+    """
+    library_mtime = LIBRARY_FILE.stat().st_mtime
+    removed = []
+    for group in ((EMBEDDINGS_FILE, EMBEDDING_NORMS_FILE, EMBEDDING_IDS_FILE), (LIBRARY_PARQUET_FILE,)):
+        present = [path for path in group if path.exists()]
+        if any(path.stat().st_mtime < library_mtime for path in present):
+            for path in present:
+                path.unlink()
+            removed += present
+    return removed
 
 
-def recalculate_analytics(books):
-    """Recalculate analytics based on filtered book list."""
-    from datetime import datetime
+def filter_embedding_sidecar(filtered_ids):
+    """Drop excluded rows from the binary embeddings sidecar, if present.
     
-    read_books = [b for b in books if b.get('is_read', False)]
-    unread_books = [b for b in books if not b.get('is_read', False)]
+    Returns the number of rows kept, or None when there is no sidecar.
+    """
+    sidecar_files = (EMBEDDINGS_FILE, EMBEDDING_NORMS_FILE, EMBEDDING_IDS_FILE)
+    if not all(path.exists() for path in sidecar_files):
+        return None
     
-    # Rating distribution
-    rating_counts = Counter(b.get('my_rating', 0) for b in read_books)
-    rating_distribution = [{"rating": r, "count": rating_counts.get(r, 0)} for r in [5, 4, 3, 2, 1, 0]]
+    with open(EMBEDDING_IDS_FILE, 'rb') as f:
+        embedding_ids = orjson.loads(f.read())
+    keep_idx = [row for row, book_id in enumerate(embedding_ids) if book_id in filtered_ids]
     
-    # Genre breakdown
-    genre_counter = Counter()
-    for book in read_books:
-        genres = book.get('genres', '[]')
-        if isinstance(genres, str):
-            try:
-                genres = json.loads(genres)
-            except:
-                genres = []
-        for g in genres[:3]:  # Top 3 genres per book
-            genre_counter[g] += 1
-    genre_breakdown = [{"genre": g, "count": c} for g, c in genre_counter.most_common(15)]
+    for path in (EMBEDDINGS_FILE, EMBEDDING_NORMS_FILE):
+        # mmap the array so only the kept rows are ever read into memory
+        array = np.load(path, mmap_mode='r')
+        kept = array[keep_idx]
+        del array
+        
+        tmp_file = path.with_name(path.name + '.tmp')
+        with open(tmp_file, 'wb') as f:
+            np.save(f, kept)
+        os.replace(tmp_file, path)
     
-    # Top authors
-    author_counter = Counter(b.get('author', 'Unknown') for b in read_books)
-    top_authors = [{"author": a, "count": c} for a, c in author_counter.most_common(10)]
+    atomic_write(EMBEDDING_IDS_FILE, orjson.dumps([embedding_ids[row] for row in keep_idx]))
+    return len(keep_idx)
+
+
+def filter_library_parquet(filtered_ids):
+    """Drop excluded books from library.parquet and renumber embedding_row, if present.
+    
+    The sidecar keeps its surviving rows in order, so each kept row's new index is
+    its rank among the kept rows. Returns the number of books kept, or None.
+    """
+    if not LIBRARY_PARQUET_FILE.exists():
+        return None
+    
+    metadata = pd.read_parquet(LIBRARY_PARQUET_FILE)
+    metadata = metadata[metadata['id'].isin(filtered_ids)]
+    metadata = metadata.assign(embedding_row=(metadata['embedding_row'].rank(method='first') - 1).astype('Int64'))
     
-    # Reading timeline
+    tmp_file = LIBRARY_PARQUET_FILE.with_name(LIBRARY_PARQUET_FILE.name + '.tmp')
+    metadata.to_parquet(tmp_file, engine='pyarrow', compression='zstd', index=False)
+    os.replace(tmp_file, LIBRARY_PARQUET_FILE)
+    return len(metadata)
+
+
+def filter_galaxy(filtered_ids):
+    """Stream-filter excluded books out of the galaxy coordinates; returns points kept."""
+    kept = 0
+    with json_array_writer(GALAXY_FILE) as write_point, open(GALAXY_FILE, 'rb') as src:
+        for point in ijson.items(src, 'item', use_float=True):
+            if point['id'] in filtered_ids:
+                write_point(point)
+                kept += 1
+    return kept
+
+
+def filter_galaxy_coords(filtered_ids):
+    """Drop excluded rows from the binary galaxy coordinates, if present.
+    
+    Returns the number of rows kept, or None when there is no file.
+    """
+    if not GALAXY_COORDS_FILE.exists():
+        return None
+    
+    with np.load(GALAXY_COORDS_FILE) as data:
+        arrays = {name: data[name] for name in data.files}
+    keep = np.isin(arrays['ids'], list(filtered_ids))
+    
+    tmp_file = GALAXY_COORDS_FILE.with_name(GALAXY_COORDS_FILE.name + '.tmp')
+    with open(tmp_file, 'wb') as f:
+        np.savez_compressed(f, **{name: array[keep] for name, array in arrays.items()})
+    os.replace(tmp_file, GALAXY_COORDS_FILE)
+    return int(keep.sum())
+
+
+def write_analytics(books):
+    """Recalculate analytics for the kept books and save them."""
+    analytics = recalculate_analytics(books)
+    atomic_write(ANALYTICS_FILE, orjson.dumps(analytics, option=orjson.OPT_INDENT_2))  # Small, kept human-readable
+    return analytics
+
+
+def recalculate_analytics(books):
+    """Recalculate analytics based on filtered book list."""
+    from datetime import datetime
+    
+    rating_counts = Counter()
+    genre_counter = Counter()
+    author_counter = Counter()
     timeline_counter = Counter()
-    for book in read_books:
+    read_n = 0
+    unread_n = 0
+    books_with_desc = 0
+    
+    # Single pass over the library, updating every accumulator inline
+    for book in books:
+        if book['_description_len'] > 50:
+            books_with_desc += 1
+        
+        if not book.get('is_read', False):
+            unread_n += 1
+            continue
+        
+        read_n += 1
+        rating_counts[book.get('my_rating', 0)] += 1
+        
+        genre_counter.update(book['_genres'][:3])  # Top 3 genres per book
+        author_counter[book.get('author', 'Unknown')] += 1
+        
         date_read = book.get('date_read')
         if date_read:
-            try:
-                # Handle YYYY/MM/DD format
-                year_month = date_read[:7].replace('/', '-')
-                timeline_counter[year_month] += 1
-            except:
-                pass
+            # Handle YYYY/MM/DD format
+            timeline_counter[date_read[:7].translate(SLASH_TO_DASH)] += 1
+    
+    rating_distribution = [{"rating": r, "count": rating_counts.get(r, 0)} for r in [5, 4, 3, 2, 1, 0]]
+    genre_breakdown = [{"genre": g, "count": c} for g, c in genre_counter.most_common(15)]
+    top_authors = [{"author": a, "count": c} for a, c in author_counter.most_common(10)]
     reading_timeline = [{"year_month": ym, "count": c} for ym, c in sorted(timeline_counter.items())]
     
     # Shelf summary
     shelf_summary = [
-        {"shelf": "read", "count": len(read_books)},
-        {"shelf": "unread", "count": len(unread_books)}
+        {"shelf": "read", "count": read_n},
+        {"shelf": "unread", "count": unread_n}
     ]
     
-    # Calculate averages
-    ratings = [b['my_rating'] for b in read_books if b.get('my_rating', 0) > 0]
-    avg_rating = round(sum(ratings) / len(ratings), 2) if ratings else 0
-    
-    # Books with descriptions
-    books_with_desc = len([b for b in books if b.get('description') and len(b['description']) > 50])
+    # Average over rated books, derived from the rating Counter (no extra pass)
+    ratings_n = sum(c for r, c in rating_counts.items() if r > 0)
+    ratings_sum = sum(r * c for r, c in rating_counts.items() if r > 0)
+    avg_rating = round(ratings_sum / ratings_n, 2) if ratings_n else 0
     
     analytics = {
         "summary": {
             "total_books": len(books),
-            "books_read": len(read_books),
-            "books_unread": len(unread_books),
+            "books_read": read_n,
+            "books_unread": unread_n,
             "books_with_descriptions": books_with_desc,
-            "five_star_books": len([b for b in read_books if b.get('my_rating') == 5]),
+            "five_star_books": rating_counts.get(5, 0),
             "average_rating": avg_rating,
             "coverage_percent": round(books_with_desc / len(books) * 100, 1) if books else 0,
             "generated_at": datetime.now().isoformat()
@@ -165,7 +361,7 @@ def run_exclusions():
     print("=" * 70)
     
     # Load exclusions config
-    print("\n[1/5] Loading exclusions config...")
+    print("\n[1/3] Loading exclusions config...")
     exclusions = load_exclusions()
     rules = exclusions.get('rules', {})
     print(f"   ✓ Rules:")
@@ -175,51 +371,58 @@ def run_exclusions():
     print(f"   ✓ Exclude authors: {len(exclusions.get('exclude_authors', []))}")
     print(f"   ✓ Exclude IDs: {len(exclusions.get('exclude_ids', []))}")
     
-    # Load library data
-    print("\n[2/5] Loading library data...")
-    with open(LIBRARY_FILE, 'r') as f:
-        books = json.load(f)
-    print(f"   ✓ Loaded {len(books)} books")
-    
-    # Apply exclusions
-    print("\n[3/5] Applying exclusions...")
+    # Stream the library: each book is filtered and written out as it is parsed,
+    # so only the lightweight summaries stay resident (never the embeddings)
+    print("\n[2/3] Streaming library data and applying exclusions...")
     excluded_books = []
     filtered_books = []
     exclusion_reasons = Counter()
+    total_books = 0
+    should_exclude = make_excluder(exclusions)
     
-    for book in books:
-        exclude, reason = should_exclude(book, exclusions)
-        if exclude:
-            excluded_books.append(book)
-            exclusion_reasons[reason] += 1
-        else:
-            filtered_books.append(book)
+    for path in remove_stale_sidecars():
+        print(f"   ⚠ Removed stale {path.name} (older than {LIBRARY_FILE.name})")
     
+    with json_array_writer(LIBRARY_FILE) as write_book, open(LIBRARY_FILE, 'rb') as src:
+        for book in ijson.items(src, 'item', use_float=True):
+            total_books += 1
+            exclude, reason = should_exclude(book)
+            if exclude:
+                excluded_books.append((summarize_book(book), reason))
+                exclusion_reasons[reason] += 1
+            else:
+                write_book(book)
+                filtered_books.append(summarize_book(book))
+    
+    print(f"   ✓ Loaded {total_books} books")
     print(f"   ✓ Excluded {len(excluded_books)} books:")
     for reason, count in exclusion_reasons.most_common():
         print(f"      • {reason}: {count}")
     print(f"   ✓ Keeping {len(filtered_books)} books")
-    
-    # Save filtered library
-    print("\n[4/5] Saving filtered data...")
-    with open(LIBRARY_FILE, 'w') as f:
-        json.dump(filtered_books, f, indent=2)
     print(f"   ✓ Saved {LIBRARY_FILE.name}")
     
-    # Filter and save galaxy coordinates
+    # Galaxy, embeddings and analytics only depend on the kept books, so they
+    # run in parallel: file I/O overlaps the CPU-bound analytics pass
+    print("\n[3/3] Writing galaxy coordinates, embeddings and analytics...")
     filtered_ids = {b['id'] for b in filtered_books}
-    with open(GALAXY_FILE, 'r') as f:
-        galaxy_data = json.load(f)
-    filtered_galaxy = [g for g in galaxy_data if g['id'] in filtered_ids]
-    with open(GALAXY_FILE, 'w') as f:
-        json.dump(filtered_galaxy, f, indent=2)
-    print(f"   ✓ Saved {GALAXY_FILE.name} ({len(filtered_galaxy)} points)")
-    
-    # Recalculate and save analytics
-    print("\n[5/5] Recalculating analytics...")
-    analytics = recalculate_analytics(filtered_books)
-    with open(ANALYTICS_FILE, 'w') as f:
-        json.dump(analytics, f, indent=2)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        galaxy_future = pool.submit(filter_galaxy, filtered_ids)
+        embeddings_future = pool.submit(filter_embedding_sidecar, filtered_ids)
+        parquet_future = pool.submit(filter_library_parquet, filtered_ids)
+        galaxy_coords_future = pool.submit(filter_galaxy_coords, filtered_ids)
+        analytics_future = pool.submit(write_analytics, filtered_books)
+    
+    print(f"   ✓ Saved {GALAXY_FILE.name} ({galaxy_future.result()} points)")
+    kept_embeddings = embeddings_future.result()
+    if kept_embeddings is not None:
+        print(f"   ✓ Saved {EMBEDDINGS_FILE.name} ({kept_embeddings} vectors)")
+    kept_metadata = parquet_future.result()
+    if kept_metadata is not None:
+        print(f"   ✓ Saved {LIBRARY_PARQUET_FILE.name} ({kept_metadata} books)")
+    kept_coords = galaxy_coords_future.result()
+    if kept_coords is not None:
+        print(f"   ✓ Saved {GALAXY_COORDS_FILE.name} ({kept_coords} points)")
+    analytics_future.result()
     print(f"   ✓ Saved {ANALYTICS_FILE.name}")
     
     # Print excluded books for review
@@ -228,8 +431,7 @@ def run_exclusions():
     print("=" * 70)
     for reason in exclusion_reasons:
         print(f"\n{reason}:")
-        for book in excluded_books:
-            _, r = should_exclude(book, exclusions)
+        for book, r in excluded_books:
             if r == reason:
                 rating = '★' * book.get('my_rating', 0) if book.get('my_rating', 0) > 0 else 'unrated'
                 print(f"   • {book['title']} by {book['author']} ({rating})")
@@ -238,7 +440,7 @@ def run_exclusions():
     print("✅ Exclusions Applied Successfully!")
     print("=" * 70)
     print(f"\n📊 Final counts:")
-    print(f"   • Original: {len(books)} books")
+    print(f"   • Original: {total_books} books")
     print(f"   • Excluded: {len(excluded_books)} books")
     print(f"   • Published: {len(filtered_books)} books")
     print(f"\n💡 To add more exclusions, edit: {EXCLUSIONS_FILE}")
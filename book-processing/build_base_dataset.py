@@ -14,7 +14,11 @@ Usage:
   python build_base_dataset.py
 """
 
+import ast
+import csv
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import re
 import hashlib
 import json
@@ -29,8 +33,22 @@ OUTPUT_DIR = SCRIPT_DIR
 GOODREADS_FILE = DATA_DIR / 'goodreads_library_export.csv'
 KAGGLE_FILE = DATA_DIR / 'books_1.Best_Books_Ever.csv'
 OUTPUT_FILE = OUTPUT_DIR / 'book_records_v3_backfilled_local.csv'
+OUTPUT_PARQUET_FILE = OUTPUT_FILE.with_suffix('.parquet')  # Same rows, typed + columnar
 QUEUE_FILE = OUTPUT_DIR / 'enrichment_queue_v1.csv'
 
+# Only the columns used below are parsed; ISBNs are forced to text so
+# all-digit values never round-trip through int/float
+GOODREADS_COLUMNS = {
+    'Book Id', 'Title', 'Author', 'ISBN', 'ISBN13', 'Exclusive Shelf', 'Year Published',
+    'Original Publication Year', 'Average Rating', 'My Rating', 'Date Read',
+}
+GOODREADS_TEXT_COLUMNS = {'ISBN', 'ISBN13'}
+KAGGLE_COLUMNS = {
+    'bookId', 'title', 'author', 'isbn', 'language', 'numRatings', 'rating',
+    'description', 'genres', 'coverImg', 'publishDate',
+}
+KAGGLE_TEXT_COLUMNS = {'isbn'}
+
 # --- THRESHOLDS ---
 MIN_DESCRIPTION_LENGTH = 80  # Characters
 MIN_KAGGLE_RATINGS_COUNT = 1000  # Minimum ratings for quality filter
@@ -38,199 +56,273 @@ TOP_N_POPULAR_BOOKS = 10000  # Take top N most popular unread books
 DESCRIPTION_EMBEDDING_MAX_CHARS = 2000  # Cap for embedding input
 
 
+# Arrow-backed strings: text lives in Arrow buffers and .str ops use Arrow kernels
+TEXT_DTYPE = pd.StringDtype('pyarrow')
+
+
+# --- COMPILED PATTERNS ---
+# Compiled once at import. The .str methods get the .pattern string: pandas 2.0
+# drops Arrow-backed columns to the slow object path when handed a compiled regex.
+# Arrow runs those strings on RE2, where \s and \d are ASCII-only, so both are
+# spelled out as explicit classes holding the same characters as Python's.
+
+def char_class(predicate, stop: int) -> str:
+    """Regex character class (as ranges) of the code points below `stop` matching `predicate`."""
+    chars = [c for c in range(stop) if predicate(chr(c))]
+    ranges = []
+    for c in chars:
+        if ranges and ranges[-1][1] == c - 1:
+            ranges[-1][1] = c
+        else:
+            ranges.append([c, c])
+    return '[' + ''.join(chr(a) if a == b else f'{chr(a)}-{chr(b)}' for a, b in ranges) + ']'
+
+WS = char_class(str.isspace, 0x3001)  # Python's \s (NBSP, U+2009, U+3000, ...)
+DIGIT = char_class(str.isdecimal, 0x20000)  # Python's \d (all Unicode decimal digits)
+
+WHITESPACE_PATTERN = re.compile(f'{WS}+')
+# Anything that is not a digit or ISBN-10 check character (drops Excel ="..." wrapping too)
+ISBN_STRIP_PATTERN = re.compile(r'[^0-9Xx]')
+# "Last, First" split on the first comma only
+LAST_FIRST_PATTERN = re.compile(r'^([^,]*),(.*)$', re.DOTALL)
+# Title cleanup for dedup
+SERIES_SUFFIX_PATTERN = re.compile(rf'{WS}*\([^)]*,{WS}*#?{DIGIT}+(?:\.{DIGIT}+)?\){WS}*$')
+TRAILING_PARENS_PATTERN = re.compile(rf'{WS}*\([^)]+\){WS}*$')
+BRACKETS_PATTERN = re.compile(rf'{WS}*\[[^\]]+\]{WS}*')
+A_NOVEL_PATTERN = re.compile(rf':{WS}+a novel.*$')
+BOOK_NUMBER_PATTERN = re.compile(rf':{WS}+book {DIGIT}+.*$')
+# Author cleanup for dedup
+PARENS_PATTERN = re.compile(rf'{WS}*\([^)]+\)')
+CO_AUTHOR_SPLIT_PATTERN = re.compile(rf',{WS}+(?=[A-Z])')  # Lookahead: pandas splits this one in Python
+HTML_TAG_PATTERN = re.compile(r'<[^>]+>')
+
+
 # --- HELPERS ---
 
-def clean_isbn(val) -> Optional[str]:
-    """Standardize ISBN by removing Excel formatting and non-numeric chars."""
-    if pd.isna(val):
-        return None
-    # Remove Excel: ="1234567890" -> 1234567890
-    cleaned = re.sub(r'[=""\s-]', '', str(val)).strip()
-    # Remove any remaining non-numeric (except X for ISBN10)
-    cleaned = re.sub(r'[^0-9Xx]', '', cleaned).upper()
-    if len(cleaned) < 10:
-        return None
-    return cleaned
-
-
-def normalize_text(text: str) -> str:
-    """Normalize for matching: lowercase, strip, collapse whitespace."""
-    if pd.isna(text):
-        return ''
-    text = str(text).lower().strip()
-    text = re.sub(r'\s+', ' ', text)
-    return text
+def read_csv_columns(path: Path, columns: set, text_columns: set) -> pd.DataFrame:
+    """Load only `columns` (those present in the header) with Arrow's multithreaded CSV reader."""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        header = next(csv.reader(f))
+    include = [c for c in header if c in columns]
+    
+    table = pacsv.read_csv(
+        path,
+        parse_options=pacsv.ParseOptions(newlines_in_values=True),  # Descriptions span lines
+        convert_options=pacsv.ConvertOptions(
+            include_columns=include,
+            column_types={c: pa.string() for c in include if c in text_columns},
+            strings_can_be_null=True,  # Empty cells -> missing, like pandas
+        ),
+    )
+    # Text columns load straight into TEXT_DTYPE, never boxed as Python str objects
+    return table.to_pandas(types_mapper={pa.string(): TEXT_DTYPE}.get)
+
+
+def vec_clean_isbn(s: pd.Series) -> pd.Series:
+    """Standardize a column of ISBNs: strip Excel formatting and non-numeric chars.
+    
+    Runs as vectorized string ops over the whole column; values shorter than
+    10 characters (or missing) become NaN.
+    """
+    cleaned = s.astype(TEXT_DTYPE).str.replace(ISBN_STRIP_PATTERN.pattern, '', regex=True).str.upper()
+    return cleaned.where(s.notna() & (cleaned.str.len() >= 10))
+
+
+def vec_lower(s: pd.Series) -> pd.Series:
+    """Lowercase exactly like str.lower().
+    
+    Arrow's kernel agrees except for U+0130 (İ -> 'i' + U+0307) and the
+    word-final sigma (Σ -> ς), so rows holding either go through Python.
+    """
+    lowered = s.str.lower()
+    special = s.str.contains('[\u0130\u03a3]', regex=True).fillna(False).to_numpy(dtype=bool)
+    if special.any():
+        lowered[special] = s[special].astype(object).map(str.lower, na_action='ignore').to_numpy()
+    return lowered
 
 
-def normalize_title_for_dedup(title: str) -> str:
+def vec_normalize_text(s: pd.Series) -> pd.Series:
+    r"""Normalize for matching: lowercase, strip, collapse whitespace.
+    
+    Non-ASCII spaces collapse too, the same as with Python's re:
+    >>> vec_normalize_text(pd.Series(['Foo\u3000Bar', ' A\u00a0\u2009B ', 'İSTANBUL ΣΑΣ'])).tolist()
+    ['foo bar', 'a b', 'i̇stanbul σας']
     """
-    Normalize title for deduplication by removing:
+    return vec_lower(s.fillna('').astype(TEXT_DTYPE)).str.strip().str.replace(WHITESPACE_PATTERN.pattern, ' ', regex=True)
+
+
+def vec_normalize_author(s: pd.Series) -> pd.Series:
+    """Convert 'Last, First' to 'First Last' for better matching."""
+    author = s.fillna('').astype(TEXT_DTYPE).str.strip()
+    # Split on the first comma only: "King, Stephen" -> ("King", " Stephen")
+    parts = author.str.extract(LAST_FIRST_PATTERN.pattern, flags=LAST_FIRST_PATTERN.flags)
+    flipped = parts[1].str.strip().str.cat(parts[0].str.strip(), sep=' ')
+    return flipped.where(parts[0].notna(), author)
+
+
+def vec_normalize_title_for_dedup(s: pd.Series) -> pd.Series:
+    """
+    Normalize titles for deduplication by removing:
     - Series info like "(Harry Potter, #1)"
     - Edition info like "[Special Edition]"
     - Subtitle markers
     """
-    if pd.isna(title):
-        return ''
-    title = str(title).strip()
+    title = s.fillna('').astype(TEXT_DTYPE).str.strip()
     
     # Remove series info in parentheses at the end: "Book Title (Series, #3)"
-    title = re.sub(r'\s*\([^)]*,\s*#?\d+(?:\.\d+)?\)\s*$', '', title)
+    title = title.str.replace(SERIES_SUFFIX_PATTERN.pattern, '', regex=True)
     
     # Remove other parenthetical info at end
-    title = re.sub(r'\s*\([^)]+\)\s*$', '', title)
+    title = title.str.replace(TRAILING_PARENS_PATTERN.pattern, '', regex=True)
     
     # Remove bracketed info: [Hardcover], [Special Edition]
-    title = re.sub(r'\s*\[[^\]]+\]\s*', '', title)
+    title = title.str.replace(BRACKETS_PATTERN.pattern, '', regex=True)
     
     # Normalize
-    title = title.lower().strip()
-    title = re.sub(r'\s+', ' ', title)
+    title = vec_lower(title).str.strip().str.replace(WHITESPACE_PATTERN.pattern, ' ', regex=True)
     
     # Remove common subtitle patterns
-    title = re.sub(r':\s+a novel.*$', '', title)
-    title = re.sub(r':\s+book \d+.*$', '', title)
+    title = title.str.replace(A_NOVEL_PATTERN.pattern, '', regex=True)
+    title = title.str.replace(BOOK_NUMBER_PATTERN.pattern, '', regex=True)
     
     return title
 
 
-def normalize_author(author: str) -> str:
-    """Convert 'Last, First' to 'First Last' for better matching."""
-    if pd.isna(author):
-        return ''
-    author = str(author).strip()
-    # Handle "King, Stephen" -> "Stephen King"
-    if ',' in author:
-        parts = [p.strip() for p in author.split(',', 1)]
-        if len(parts) == 2:
-            author = f"{parts[1]} {parts[0]}"
-    return author
-
-
-def normalize_author_for_dedup(author: str) -> str:
+def vec_normalize_author_for_dedup(s: pd.Series) -> pd.Series:
     """
-    Extract primary author for deduplication.
+    Extract primary authors for deduplication.
     Handles cases like "J.K. Rowling, Mary GrandPré (Illustrator)" -> "j.k. rowling"
     """
-    if pd.isna(author):
-        return ''
-    author = str(author).strip()
+    author = s.fillna('').astype(TEXT_DTYPE).str.strip()
     
     # Remove parenthetical info (Illustrator), (Editor), etc.
-    author = re.sub(r'\s*\([^)]+\)', '', author)
+    author = author.str.replace(PARENS_PATTERN.pattern, '', regex=True)
     
     # Take only first author (before comma that separates co-authors)
     # But be careful not to split "Rowling, J.K." style names
     # If there's a comma followed by a capitalized word, it's likely a co-author
-    parts = re.split(r',\s+(?=[A-Z])', author)
-    if parts:
-        author = parts[0].strip()
+    author = author.str.split(CO_AUTHOR_SPLIT_PATTERN.pattern, n=1, regex=True).str[0].str.strip()
     
-    # Handle "Last, First" format
-    if ',' in author:
-        name_parts = [p.strip() for p in author.split(',', 1)]
-        if len(name_parts) == 2 and len(name_parts[1].split()) <= 2:
-            author = f"{name_parts[1]} {name_parts[0]}"
+    # Handle "Last, First" format (only when "First" is at most two words)
+    parts = author.str.extract(LAST_FIRST_PATTERN.pattern, flags=LAST_FIRST_PATTERN.flags)
+    first = parts[1].str.strip()
+    flip = parts[0].notna() & (first.str.split().str.len() <= 2)
+    author = first.str.cat(parts[0].str.strip(), sep=' ').where(flip, author)
     
-    return author.lower().strip()
+    return vec_lower(author).str.strip()
 
 
-def generate_book_key(isbn13: Optional[str], title: str, author: str, book_id: Optional[str] = None) -> str:
-    """Generate stable book_key: isbn:<isbn13>, gr:<book_id>, or ta:<hash>."""
+def vec_generate_book_key(isbn13: pd.Series, title: pd.Series, author: pd.Series,
+                          book_id: Optional[pd.Series] = None) -> pd.Series:
+    """Generate stable book_keys: isbn:<isbn13>, gr:<book_id>, or ta:<hash>.
+    
+    The prefix branches are plain column ops; only rows falling through to the
+    title+author branch are hashed.
+    """
+    keys = pd.Series(None, index=isbn13.index, dtype=object)
     # Priority 1: ISBN (most stable) - check for valid ISBN, not just truthy
-    if isbn13 and not pd.isna(isbn13) and isbn13 != 'nan':
-        return f"isbn:{isbn13}"
+    has_isbn = isbn13.notna() & (isbn13 != 'nan')
+    keys[has_isbn] = 'isbn:' + isbn13[has_isbn].astype(str)
+    remaining = ~has_isbn
     # Priority 2: Goodreads Book ID (for user's read books)
-    if book_id and not pd.isna(book_id):
-        return f"gr:{book_id}"
-    # Priority 3: Hash title+author (for Kaggle books without ISBN)
-    combined = f"{normalize_text(title)}|{normalize_text(author)}"
-    hash_hex = hashlib.md5(combined.encode('utf-8')).hexdigest()[:12]
-    return f"ta:{hash_hex}"
-
-
-def clean_description(desc: str) -> str:
-    """Clean description: strip HTML, normalize whitespace, handle em dashes."""
-    if pd.isna(desc):
-        return ''
-    desc = str(desc)
+    if book_id is not None:
+        has_book_id = remaining & book_id.notna()
+        keys[has_book_id] = 'gr:' + book_id[has_book_id].astype(str)
+        remaining &= ~has_book_id
+    # Priority 3: Hash title+author (for Kaggle books without ISBN).
+    # Non-cryptographic use, so a 6-byte BLAKE2b digest (12 hex chars) is plenty
+    combined = vec_normalize_text(title[remaining]).str.cat(vec_normalize_text(author[remaining]), sep='|')
+    keys[remaining] = ['ta:' + hashlib.blake2b(c.encode('utf-8'), digest_size=6).hexdigest() for c in combined]
+    return keys
+
+
+def vec_clean_description(s: pd.Series) -> pd.Series:
+    """Clean descriptions: strip HTML, normalize whitespace, handle em dashes."""
+    desc = s.fillna('').astype(TEXT_DTYPE)
     # Strip HTML tags
-    desc = re.sub(r'<[^>]+>', '', desc)
+    desc = desc.str.replace(HTML_TAG_PATTERN.pattern, '', regex=True)
     # Replace em dash with period+space (better for sentence breaks)
-    desc = desc.replace('—', '. ').replace('–', '. ')
+    desc = desc.str.replace('—', '. ', regex=False).str.replace('–', '. ', regex=False)
     # Normalize whitespace
-    desc = re.sub(r'\s+', ' ', desc).strip()
-    return desc
-
-
-def prepare_embedding_text(title: str, author: str, description: str, genres: str) -> str:
-    """Prepare text for embedding: Title + Author + Genres + Description (capped)."""
-    parts = []
-    if title:
-        parts.append(f"Title: {title}")
-    if author:
-        parts.append(f"Author: {author}")
-    if genres:
-        parts.append(f"Genres: {genres}")
-    if description:
-        # Cap description length
-        if len(description) > DESCRIPTION_EMBEDDING_MAX_CHARS:
-            description = description[:DESCRIPTION_EMBEDDING_MAX_CHARS] + "..."
-        parts.append(f"Description: {description}")
-    
-    return " | ".join(parts)
-
-
-def parse_genres(genres_val) -> list:
-    """Parse genres field (might be string list or JSON)."""
-    if pd.isna(genres_val):
-        return []
-    if isinstance(genres_val, list):
-        return genres_val
-    # Try parsing as JSON/string list
+    return desc.str.replace(WHITESPACE_PATTERN.pattern, ' ', regex=True).str.strip()
+
+
+def vec_prepare_embedding_text(title: pd.Series, author: pd.Series,
+                               description: pd.Series, genres: pd.Series) -> pd.Series:
+    """Prepare text for embedding: Title + Author + Genres + Description (capped).
+    
+    Built column-wise; empty or missing parts are skipped along with their separator.
+    """
+    # Cap description length
+    description = description.fillna('').astype(TEXT_DTYPE)
+    too_long = description.str.len() > DESCRIPTION_EMBEDDING_MAX_CHARS
+    ellipsis = pd.Series('...', index=description.index, dtype=TEXT_DTYPE)
+    description = description.where(~too_long, description.str.slice(0, DESCRIPTION_EMBEDDING_MAX_CHARS).str.cat(ellipsis))
+    
+    text = pd.Series('', index=description.index, dtype=TEXT_DTYPE)
+    for label, part in (('Title', title), ('Author', author), ('Genres', genres), ('Description', description)):
+        part = part.fillna('').astype(TEXT_DTYPE)
+        present = part != ''
+        separator = pd.Series(' | ', index=text.index, dtype=TEXT_DTYPE).where(present & (text != ''), '')
+        labelled = pd.Series(f'{label}: ', index=text.index, dtype=TEXT_DTYPE).str.cat(part)
+        text = text.str.cat([separator, labelled.where(present, '')])
+    
+    return text
+
+
+def literal_genres(genres_val: str) -> list:
+    """Parse a string list like "['Fiction', 'Fantasy']"; malformed values give []."""
     try:
-        if isinstance(genres_val, str):
-            genres_val = genres_val.strip()
-            # Handle string like "['Fiction', 'Fantasy']"
-            if genres_val.startswith('['):
-                import ast
-                return ast.literal_eval(genres_val)
-            # Handle comma-separated
-            return [g.strip() for g in genres_val.split(',') if g.strip()]
-    except:
-        pass
-    return []
-
-
-def infer_primary_genre(genres_list: list) -> str:
-    """Map genres to coarse categories for UI filtering."""
-    if not genres_list:
-        return 'Unknown'
-    
-    # Simple mapping (expand as needed)
-    genre_map = {
-        'fiction': 'Fiction',
-        'fantasy': 'Fantasy',
-        'science fiction': 'Science Fiction',
-        'mystery': 'Mystery',
-        'thriller': 'Thriller',
-        'romance': 'Romance',
-        'historical': 'Historical',
-        'biography': 'Biography',
-        'nonfiction': 'Nonfiction',
-        'self help': 'Self-Help',
-        'business': 'Business',
-        'history': 'History',
-        'science': 'Science',
-        'philosophy': 'Philosophy',
-        'technology': 'Technology',
-    }
-    
-    first_genre = str(genres_list[0]).lower()
-    for key, value in genre_map.items():
-        if key in first_genre:
-            return value
-    
-    return genres_list[0] if genres_list else 'Unknown'
+        return ast.literal_eval(genres_val)
+    except Exception:
+        return []
+
+
+def vec_parse_genres(s: pd.Series) -> pd.Series:
+    """Parse genres fields (string lists or comma-separated) into lists.
+    
+    Rows are partitioned once: bracketed values go through literal_eval,
+    the rest are split on commas.
+    """
+    genres = s.fillna('[]').astype(TEXT_DTYPE).str.strip()
+    is_list = genres.str.startswith('[')
+    
+    # Handle string like "['Fiction', 'Fantasy']"
+    from_literal = genres[is_list].map(literal_genres)
+    # Handle comma-separated
+    from_commas = genres[~is_list].str.split(',').map(lambda parts: [g.strip() for g in parts if g.strip()])
+    
+    return pd.concat([from_literal, from_commas]).reindex(s.index)
+
+
+# Coarse genre categories for UI filtering (expand as needed)
+GENRE_MAP = {
+    'fiction': 'Fiction',
+    'fantasy': 'Fantasy',
+    'science fiction': 'Science Fiction',
+    'mystery': 'Mystery',
+    'thriller': 'Thriller',
+    'romance': 'Romance',
+    'historical': 'Historical',
+    'biography': 'Biography',
+    'nonfiction': 'Nonfiction',
+    'self help': 'Self-Help',
+    'business': 'Business',
+    'history': 'History',
+    'science': 'Science',
+    'philosophy': 'Philosophy',
+    'technology': 'Technology',
+}
+# One alternation over all keys, longest first so 'science fiction' wins over 'fiction'
+GENRE_PATTERN = re.compile('(' + '|'.join(map(re.escape, sorted(GENRE_MAP, key=len, reverse=True))) + ')')
+
+
+def vec_infer_primary_genre(genres: pd.Series) -> pd.Series:
+    """Map each book's first genre to a coarse category for UI filtering."""
+    first_genre = genres.str[0]
+    matched = first_genre.astype(str).str.lower().str.extract(GENRE_PATTERN, expand=False)
+    # Unmapped genres pass through as-is; books without genres are 'Unknown'
+    return matched.map(GENRE_MAP).fillna(first_genre).fillna('Unknown')
 
 
 # --- MAIN PIPELINE ---
@@ -244,14 +336,14 @@ def main():
     print("\n[1/6] Loading data files...")
     
     try:
-        goodreads = pd.read_csv(GOODREADS_FILE, encoding='utf-8')
+        goodreads = read_csv_columns(GOODREADS_FILE, GOODREADS_COLUMNS, GOODREADS_TEXT_COLUMNS)
         print(f"   ✓ Goodreads: {len(goodreads)} rows")
     except FileNotFoundError:
         print(f"   ✗ Error: {GOODREADS_FILE} not found")
         return
     
     try:
-        kaggle = pd.read_csv(KAGGLE_FILE, encoding='utf-8')
+        kaggle = read_csv_columns(KAGGLE_FILE, KAGGLE_COLUMNS, KAGGLE_TEXT_COLUMNS)
         print(f"   ✓ Kaggle: {len(kaggle)} rows")
     except FileNotFoundError:
         print(f"   ✗ Error: {KAGGLE_FILE} not found")
@@ -266,20 +358,19 @@ def main():
         print(f"   ✓ Filtered to 'read' shelf: {len(goodreads)} books")
     
     # Normalize ISBNs
-    goodreads['isbn13_clean'] = goodreads['ISBN13'].apply(clean_isbn)
-    goodreads['isbn10_clean'] = goodreads['ISBN'].apply(clean_isbn)
-    goodreads['author_norm'] = goodreads['Author'].apply(normalize_author)
-    goodreads['title_norm'] = goodreads['Title'].apply(normalize_text)
+    goodreads['isbn13_clean'] = vec_clean_isbn(goodreads['ISBN13'])
+    goodreads['isbn10_clean'] = vec_clean_isbn(goodreads['ISBN'])
+    goodreads['author_norm'] = vec_normalize_author(goodreads['Author'])
+    goodreads['title_norm'] = vec_normalize_text(goodreads['Title'])
+    # Cast Book Id once (Int64 so ids never pick up a float '.0' suffix)
+    goodreads['_book_id_str'] = goodreads['Book Id'].astype('Int64').astype('string')
     
     # Generate book_key (use Book Id for Goodreads books to avoid duplicates)
-    goodreads['book_key'] = goodreads.apply(
-        lambda row: generate_book_key(
-            row['isbn13_clean'], 
-            row['Title'], 
-            row['Author'],
-            str(row['Book Id'])  # Include Goodreads ID
-        ),
-        axis=1
+    goodreads['book_key'] = vec_generate_book_key(
+        goodreads['isbn13_clean'],
+        goodreads['Title'],
+        goodreads['Author'],
+        goodreads['_book_id_str']  # Include Goodreads ID
     )
     
     # Prepare Goodreads output schema
@@ -304,7 +395,7 @@ def main():
         'my_rating': goodreads.get('My Rating'),
         'date_read': goodreads.get('Date Read'),
         'source': 'goodreads_export',
-        'source_book_id': goodreads['Book Id'],
+        'source_book_id': goodreads['_book_id_str'],
     })
     
     print(f"   ✓ Prepared {len(gr_records)} Goodreads records")
@@ -313,51 +404,48 @@ def main():
     print("\n[3/6] Processing Kaggle dataset...")
     
     # Normalize Kaggle data
-    kaggle['isbn_clean'] = kaggle['isbn'].apply(clean_isbn)
-    kaggle['author_norm'] = kaggle['author'].apply(normalize_author)
-    kaggle['title_norm'] = kaggle['title'].apply(normalize_text)
+    kaggle['isbn_clean'] = vec_clean_isbn(kaggle['isbn'])
+    kaggle['author_norm'] = vec_normalize_author(kaggle['author'])
+    kaggle['title_norm'] = vec_normalize_text(kaggle['title'])
     
-    # Quality filters for unread corpus
+    # Quality filters for unread corpus: masks built up front, applied in one pass
     # Filter to English language books
-    kaggle = kaggle[
-        (kaggle['language'] == 'English') |
-        (kaggle['language'].str.contains('English', na=False)) |
-        (pd.isna(kaggle['language']))
-    ].copy()
-    print(f"   ✓ Language filter: {len(kaggle)} English books")
-    
-    # Filter by minimum ratings and sort by popularity
-    if 'numRatings' in kaggle.columns:
-        kaggle = kaggle[kaggle['numRatings'] >= MIN_KAGGLE_RATINGS_COUNT].copy()
-        kaggle = kaggle.sort_values('numRatings', ascending=False)
-        print(f"   ✓ Ratings filter (>= {MIN_KAGGLE_RATINGS_COUNT}): {len(kaggle)} books")
+    keep = (
+        kaggle['language'].eq('English') |
+        kaggle['language'].str.contains('English', na=False) |
+        kaggle['language'].isna()
+    )
+    print(f"   ✓ Language filter: {keep.sum()} English books")
+    
+    # Filter by minimum ratings
+    has_num_ratings = 'numRatings' in kaggle.columns
+    if has_num_ratings:
+        keep &= kaggle['numRatings'].ge(MIN_KAGGLE_RATINGS_COUNT)
+        print(f"   ✓ Ratings filter (>= {MIN_KAGGLE_RATINGS_COUNT}): {keep.sum()} books")
+    
+    kaggle = kaggle.loc[keep]
+    if has_num_ratings:
+        # Sort by popularity; stable keeps file order among equal counts
+        kaggle = kaggle.sort_values('numRatings', ascending=False, kind='stable')
     
     print(f"   ✓ Filtered Kaggle to {len(kaggle)} quality English books")
     
     # Check which Kaggle books are already in Goodreads (mark as read)
-    kaggle_isbns = set(kaggle['isbn_clean'].dropna())
-    kaggle_titles_authors = set(
-        zip(kaggle['title_norm'].fillna(''), kaggle['author_norm'].fillna(''))
-    )
-    
+    # (title_norm, author_norm) pairs as a MultiIndex: hashed in C, no Python tuples
     goodreads_isbns = set(goodreads['isbn13_clean'].dropna())
-    goodreads_titles_authors = set(
-        zip(goodreads['title_norm'].fillna(''), goodreads['author_norm'].fillna(''))
-    )
-    
-    # Mark Kaggle books as read if they match Goodreads
-    def is_already_read(row):
-        if row['isbn_clean'] and row['isbn_clean'] in goodreads_isbns:
-            return True
-        ta_tuple = (row['title_norm'], row['author_norm'])
-        if ta_tuple in goodreads_titles_authors:
-            return True
-        return False
+    goodreads_titles_authors = pd.MultiIndex.from_arrays(
+        [goodreads['title_norm'], goodreads['author_norm']]
+    ).unique()
     
-    kaggle['is_read'] = kaggle.apply(is_already_read, axis=1)
+    # Mark Kaggle books as read if they match Goodreads (by ISBN or title+author)
+    isbn_match = kaggle['isbn_clean'].isin(goodreads_isbns)
+    title_author_match = pd.MultiIndex.from_arrays(
+        [kaggle['title_norm'], kaggle['author_norm']]
+    ).isin(goodreads_titles_authors)
+    kaggle_is_read = isbn_match | title_author_match
     
     # Keep only unread books for the corpus, limited to top N most popular
-    kaggle_unread = kaggle[~kaggle['is_read']].copy()
+    kaggle_unread = kaggle.loc[~kaggle_is_read]
     print(f"   ✓ {len(kaggle_unread)} unread books from Kaggle (excluded duplicates)")
     
     # Limit to top N most popular unread books
@@ -367,10 +455,7 @@ def main():
     
     # Prepare Kaggle output schema (no book_id for Kaggle books)
     kaggle_records = pd.DataFrame({
-        'book_key': kaggle_unread.apply(
-            lambda row: generate_book_key(row['isbn_clean'], row['title'], row['author'], None),
-            axis=1
-        ),
+        'book_key': vec_generate_book_key(kaggle_unread['isbn_clean'], kaggle_unread['title'], kaggle_unread['author']),
         'title': kaggle_unread['title'],
         'author': kaggle_unread['author'],
         'isbn': kaggle_unread['isbn_clean'],
@@ -398,35 +483,36 @@ def main():
     # ===== BACKFILL GOODREADS FROM KAGGLE =====
     print("\n[4/6] Backfilling Goodreads metadata from Kaggle...")
     
-    # Create lookup dictionaries from Kaggle (drop duplicates first)
-    kaggle_by_isbn = kaggle.dropna(subset=['isbn_clean']).drop_duplicates(subset=['isbn_clean']).set_index('isbn_clean').to_dict('index')
-    kaggle_by_title_author = kaggle.drop_duplicates(subset=['title_norm', 'author_norm']).set_index(['title_norm', 'author_norm']).to_dict('index')
-    
-    backfill_count = 0
-    
-    for idx, row in gr_records.iterrows():
-        # Try ISBN match first
-        kaggle_match = None
-        if row['isbn13'] and row['isbn13'] in kaggle_by_isbn:
-            kaggle_match = kaggle_by_isbn[row['isbn13']]
-        # Try title+author fallback
-        elif (row['title'], row['author']) in goodreads_titles_authors:
-            title_norm = normalize_text(row['title'])
-            author_norm = normalize_text(normalize_author(row['author']))
-            if (title_norm, author_norm) in kaggle_by_title_author:
-                kaggle_match = kaggle_by_title_author[(title_norm, author_norm)]
-        
-        if kaggle_match:
-            gr_records.at[idx, 'description_raw'] = kaggle_match.get('description', '')
-            gr_records.at[idx, 'genres_list'] = kaggle_match.get('genres', '[]')
-            gr_records.at[idx, 'cover_image_url'] = kaggle_match.get('coverImg', '')
-            if pd.isna(row['avg_rating']):
-                gr_records.at[idx, 'avg_rating'] = kaggle_match.get('rating')
-            # Backfill popularity_score (numRatings) from Kaggle
-            if pd.isna(row['popularity_score']) or row['popularity_score'] == 0:
-                gr_records.at[idx, 'popularity_score'] = kaggle_match.get('numRatings', 0)
-                gr_records.at[idx, 'num_ratings'] = kaggle_match.get('numRatings', 0)
-            backfill_count += 1
+    # Hash-join Goodreads against Kaggle, carrying only the Kaggle row number:
+    # ISBN first, then normalized title+author for rows the ISBN join missed
+    kaggle_rows = kaggle[['isbn_clean', 'title_norm', 'author_norm']].assign(kaggle_row=range(len(kaggle)))
+    by_isbn = kaggle_rows.dropna(subset=['isbn_clean']).drop_duplicates(subset=['isbn_clean'])
+    by_title_author = kaggle_rows.drop_duplicates(subset=['title_norm', 'author_norm'])
+    
+    isbn_match = gr_records[['isbn13']].merge(
+        by_isbn[['isbn_clean', 'kaggle_row']],
+        left_on='isbn13', right_on='isbn_clean', how='left', validate='m:1'
+    )['kaggle_row']
+    title_author_match = goodreads[['title_norm', 'author_norm']].merge(
+        by_title_author[['title_norm', 'author_norm', 'kaggle_row']],
+        on=['title_norm', 'author_norm'], how='left', validate='m:1'
+    )['kaggle_row']
+    
+    kaggle_row = isbn_match.fillna(title_author_match)
+    matched = kaggle_row.notna().to_numpy()
+    kaggle_match = kaggle.iloc[kaggle_row[matched].astype(int)]
+    
+    gr_records.loc[matched, 'description_raw'] = kaggle_match['description'].to_numpy()
+    gr_records.loc[matched, 'genres_list'] = kaggle_match['genres'].to_numpy()
+    gr_records.loc[matched, 'cover_image_url'] = kaggle_match['coverImg'].to_numpy()
+    # Only fill avg_rating where Goodreads has none
+    gr_records['avg_rating'] = gr_records['avg_rating'].fillna(
+        pd.Series(kaggle_match['rating'].to_numpy(), index=gr_records.index[matched])
+    )
+    # Backfill popularity_score (numRatings) from Kaggle
+    gr_records.loc[matched, 'popularity_score'] = kaggle_match['numRatings'].to_numpy()
+    gr_records.loc[matched, 'num_ratings'] = kaggle_match['numRatings'].to_numpy()
+    backfill_count = matched.sum()
     
     print(f"   ✓ Backfilled {backfill_count}/{len(gr_records)} Goodreads books from Kaggle")
     
@@ -441,21 +527,18 @@ def main():
     print(f"     - is_read=False: {(~all_records['is_read']).sum()}")
     
     # Clean descriptions
-    all_records['description_clean'] = all_records['description_raw'].apply(clean_description)
+    all_records['description_clean'] = vec_clean_description(all_records['description_raw'])
     
     # Parse genres
-    all_records['genres_list_parsed'] = all_records['genres_list'].apply(parse_genres)
-    all_records['genre_primary'] = all_records['genres_list_parsed'].apply(infer_primary_genre)
+    all_records['genres_list_parsed'] = vec_parse_genres(all_records['genres_list'])
+    all_records['genre_primary'] = vec_infer_primary_genre(all_records['genres_list_parsed'])
     
     # Prepare embedding text
-    all_records['description_for_embedding'] = all_records.apply(
-        lambda row: prepare_embedding_text(
-            row['title'],
-            row['author'],
-            row['description_clean'],
-            ', '.join(row['genres_list_parsed']) if row['genres_list_parsed'] else ''
-        ),
-        axis=1
+    all_records['description_for_embedding'] = vec_prepare_embedding_text(
+        all_records['title'],
+        all_records['author'],
+        all_records['description_clean'],
+        all_records['genres_list_parsed'].str.join(', ')
     )
     
     # Convert genres_list_parsed back to JSON string for CSV storage
@@ -471,17 +554,18 @@ def main():
     # SECOND PASS: Remove Kaggle books where a normalized title+author exists in read books
     # This handles cases like "Harry Potter..." vs "Harry Potter... (Harry Potter, #1)"
     # and "J.K. Rowling" vs "J.K. Rowling, Mary GrandPré (Illustrator)"
-    all_records['title_norm_dedup'] = all_records['title'].apply(normalize_title_for_dedup)
-    all_records['author_norm_dedup'] = all_records['author'].apply(normalize_author_for_dedup)
-    all_records['dedup_key'] = all_records['title_norm_dedup'] + '|' + all_records['author_norm_dedup']
+    dedup_key = vec_normalize_title_for_dedup(all_records['title']).str.cat(
+        vec_normalize_author_for_dedup(all_records['author']), sep='|'
+    )
     
     # Get all dedup keys for read books
-    read_dedup_keys = set(all_records[all_records['is_read']]['dedup_key'].values)
+    is_read = all_records['is_read'].to_numpy(dtype=bool)
+    read_dedup_keys = dedup_key[is_read].unique()
     
     # Mark unread books for removal if they match a read book's dedup key
     before_title_dedup = len(all_records)
-    mask_keep = all_records['is_read'] | ~all_records['dedup_key'].isin(read_dedup_keys)
-    removed_titles = all_records[(~mask_keep)]['title'].tolist()
+    mask_keep = is_read | ~dedup_key.isin(read_dedup_keys).to_numpy()
+    removed_titles = all_records.loc[~mask_keep, 'title'].tolist()
     all_records = all_records[mask_keep]
     
     if removed_titles:
@@ -491,29 +575,31 @@ def main():
         if len(removed_titles) > 10:
             print(f"      ... and {len(removed_titles) - 10} more")
     
-    # Clean up temp columns
-    all_records = all_records.drop(columns=['title_norm_dedup', 'author_norm_dedup', 'dedup_key'])
-    
     print(f"     - Read books: {read_before_dedup} → {all_records['is_read'].sum()} ({read_before_dedup - all_records['is_read'].sum()} lost)")
     
     print(f"   ✓ Final dataset: {len(all_records)} unique books")
     print(f"      - Read: {all_records['is_read'].sum()}")
     print(f"      - Unread: {(~all_records['is_read']).sum()}")
     
-    # Save main dataset
+    # Save main dataset (CSV for compatibility, Parquet for fast downstream reads)
     all_records.to_csv(OUTPUT_FILE, index=False)
     print(f"\n   ✓ Saved: {OUTPUT_FILE}")
+    # These two columns mix numbers (Goodreads) and text (Kaggle); store them as text
+    all_records.astype({'publish_year': 'string', 'source_book_id': 'string'}).to_parquet(
+        OUTPUT_PARQUET_FILE, engine='pyarrow', compression='zstd', index=False
+    )
+    print(f"   ✓ Saved: {OUTPUT_PARQUET_FILE}")
     
     # ===== GENERATE ENRICHMENT QUEUE =====
     print("\n[6/6] Generating enrichment queue...")
     
-    # Identify books needing enrichment
-    needs_description = all_records['description_clean'].str.len() < MIN_DESCRIPTION_LENGTH
-    needs_cover = all_records['cover_image_url'].isna() | (all_records['cover_image_url'] == '')
+    # Identify books needing enrichment (plain NumPy masks: no index alignment below)
+    needs_description = (all_records['description_clean'].str.len() < MIN_DESCRIPTION_LENGTH).to_numpy(dtype=bool)
+    needs_cover = (all_records['cover_image_url'].isna() | (all_records['cover_image_url'] == '')).to_numpy(dtype=bool)
     
     needs_enrichment = needs_description | needs_cover
     
-    enrichment_queue = all_records[needs_enrichment].copy()
+    enrichment_queue = all_records.loc[needs_enrichment].copy()
     
     # Add flags for enrichment script
     enrichment_queue['needs_description'] = needs_description[needs_enrichment]
@@ -548,11 +634,11 @@ def main():
     print(f"1. Run API enrichment:")
     print(f"   python enrich_books.py \\")
     print(f"     --queue {QUEUE_FILE.name} \\")
-    print(f"     --books {OUTPUT_FILE.name} \\")
+    print(f"     --books {OUTPUT_PARQUET_FILE.name} \\")
     print(f"     --out book_records_v4_enriched.csv \\")
-    print(f"     --cache enrichment_cache.json \\")
+    print(f"     --cache enrichment_cache.jsonl \\")
     print(f"     --user_agent 'AIWithZachBookEnricher/1.0 (contact: you@yourdomain.com)' \\")
-    print(f"     --sleep 0.35")
+    print(f"     --openlibrary_rps 2")
     print(f"\n2. Replace data files in ../data/ with enriched output")
     print(f"3. Update app to use new schema")
 
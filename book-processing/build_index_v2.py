@@ -3,49 +3,70 @@
 Stage 3: ChromaDB Index Building (v2 - New Schema)
 Creates a persistent ChromaDB vector store with unified book index (read + unread).
 """
-import json
+import os
 import shutil
+from itertools import islice
 from pathlib import Path
 
+import ijson
+
 # --- CONFIGURATION ---
 SCRIPT_DIR = Path(__file__).parent
 DATA_DIR = SCRIPT_DIR.parent / 'data'
 INPUT_FILE = DATA_DIR / 'library_with_embeddings.json'
 CHROMA_DIR = DATA_DIR / 'chroma_db'
+BUILD_DIR = DATA_DIR / 'chroma_db.building'  # Scratch dir, swapped in for CHROMA_DIR on success
 COLLECTION_NAME = 'smart_books'
+BATCH_SIZE = 5000  # Books per collection.add() while streaming the library
+
+
+def batched(iterable, n):
+    """Yield lists of up to n items (itertools.batched needs Python 3.12)."""
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
+def batch_metadatas(batch):
+    """Metadata for filtering, built column by column (ChromaDB doesn't accept None values)."""
+    columns = {
+        'title': [str(b.get('title', '')) for b in batch],
+        'author': [str(b.get('author', '')) for b in batch],
+        'isbn': [str(b.get('isbn', '')) for b in batch],
+        'my_rating': [int(b.get('my_rating') or 0) for b in batch],
+        'avg_rating': [float(b.get('avg_rating') or 0.0) for b in batch],
+        'shelf': [str(b.get('shelf', 'unread')) for b in batch],
+        'is_read': ['true' if b.get('is_read') else 'false' for b in batch],
+        'date_read': [str(b.get('date_read') or '') for b in batch],
+        'pages': [int(b.get('pages') or 0) for b in batch],
+        'year_published': [int(b.get('year_published') or 0) for b in batch],
+        'genres': [str(b.get('genres', '[]')) for b in batch],
+        'genre_primary': [str(b.get('genre_primary', 'Unknown')) for b in batch],
+        'cover_url': [str(b.get('cover_url') or '') for b in batch],
+        'popularity_score': [int(b.get('popularity_score') or 0) for b in batch],
+    }
+    keys = tuple(columns)
+    return [dict(zip(keys, row)) for row in zip(*columns.values())]
+
 
 def run_pipeline():
     print("=" * 70)
     print("🗄️ SmartBooks AI - ChromaDB Index Builder (v2)")
     print("=" * 70)
     
-    # Load embeddings
-    print(f"\n[1/4] Loading embeddings...")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        books = json.load(f)
-    
-    books_with_embeddings = [b for b in books if b.get('embedding') is not None]
-    books_read = [b for b in books_with_embeddings if b.get('is_read')]
-    books_unread = [b for b in books_with_embeddings if not b.get('is_read')]
-    
-    print(f"   ✓ Loaded {len(books)} books")
-    print(f"      - With embeddings: {len(books_with_embeddings)}")
-    print(f"      - Read:            {len(books_read)}")
-    print(f"      - Unread:          {len(books_unread)}")
-    
     # Initialize ChromaDB
-    print(f"\n[2/4] Initializing ChromaDB...")
+    print(f"\n[1/3] Initializing ChromaDB...")
     import chromadb
     from chromadb.config import Settings
     
-    # Remove existing DB if present (for clean rebuild)
-    if CHROMA_DIR.exists():
-        print(f"   ⚠ Removing existing database at {CHROMA_DIR}")
-        shutil.rmtree(CHROMA_DIR)
+    if not INPUT_FILE.exists():
+        raise FileNotFoundError(f"{INPUT_FILE} not found; run generate_embeddings_v2.py first")
     
-    # Create persistent client
+    # Build into a scratch dir; the existing index is only replaced once the input streamed cleanly
+    if BUILD_DIR.exists():
+        shutil.rmtree(BUILD_DIR)
     client = chromadb.PersistentClient(
-        path=str(CHROMA_DIR),
+        path=str(BUILD_DIR),
         settings=Settings(anonymized_telemetry=False)
     )
     
@@ -56,51 +77,57 @@ def run_pipeline():
     )
     print(f"   ✓ Created collection: {COLLECTION_NAME}")
     
-    # Add documents to ChromaDB
-    print(f"\n[3/4] Adding {len(books_with_embeddings)} books to index...")
-    
-    # Prepare data for batch insert
-    ids = []
-    embeddings = []
-    documents = []
-    metadatas = []
-    
-    for book in books_with_embeddings:
-        ids.append(book['id'])
-        embeddings.append(book['embedding'])
-        documents.append(book.get('description', '') or '')
-        
-        # Store metadata for filtering (ChromaDB doesn't accept None values)
-        metadata = {
-            'title': str(book.get('title', '')),
-            'author': str(book.get('author', '')),
-            'isbn': str(book.get('isbn', '')),
-            'my_rating': int(book.get('my_rating') or 0),
-            'avg_rating': float(book.get('avg_rating') or 0.0),
-            'shelf': str(book.get('shelf', 'unread')),
-            'is_read': 'true' if book.get('is_read') else 'false',
-            'date_read': str(book.get('date_read') or ''),
-            'pages': int(book.get('pages') or 0),
-            'year_published': int(book.get('year_published') or 0),
-            'genres': str(book.get('genres', '[]')),
-            'genre_primary': str(book.get('genre_primary', 'Unknown')),
-            'cover_url': str(book.get('cover_url') or ''),
-            'popularity_score': int(book.get('popularity_score') or 0)
-        }
-        metadatas.append(metadata)
-    
-    # Batch insert (ChromaDB handles batching internally)
-    collection.add(
-        ids=ids,
-        embeddings=embeddings,
-        documents=documents,
-        metadatas=metadatas
+    # Stream books into ChromaDB: only one batch of embeddings is in memory at a time
+    print(f"\n[2/3] Streaming books into index (batches of {BATCH_SIZE})...")
+    total_books = 0
+    books_read = 0
+    books_unread = 0
+    
+    try:
+        with open(INPUT_FILE, 'rb') as f:
+            for batch in batched(ijson.items(f, 'item', use_float=True), BATCH_SIZE):
+                total_books += len(batch)
+                batch = [b for b in batch if b.get('embedding') is not None]
+                if not batch:
+                    continue
+                
+                read_in_batch = sum(1 for b in batch if b.get('is_read'))
+                books_read += read_in_batch
+                books_unread += len(batch) - read_in_batch
+                
+                collection.add(
+                    ids=[b['id'] for b in batch],
+                    embeddings=[b['embedding'] for b in batch],
+                    documents=[b.get('description', '') or '' for b in batch],
+                    metadatas=batch_metadatas(batch)
+                )
+                print(f"      … {books_read + books_unread} indexed")
+        if not books_read + books_unread:
+            raise ValueError(f"No books with embeddings in {INPUT_FILE}")
+    except Exception:
+        print(f"   ✗ Build failed; keeping the existing index at {CHROMA_DIR}")
+        shutil.rmtree(BUILD_DIR, ignore_errors=True)
+        raise
+    
+    print(f"   ✓ Loaded {total_books} books")
+    print(f"      - With embeddings: {books_read + books_unread}")
+    print(f"      - Read:            {books_read}")
+    print(f"      - Unread:          {books_unread}")
+    print(f"   ✓ Added {books_read + books_unread} documents to index")
+    
+    # Swap the new index in for the old one, then reopen it from its final location
+    if CHROMA_DIR.exists():
+        print(f"   ⚠ Replacing existing database at {CHROMA_DIR}")
+        shutil.rmtree(CHROMA_DIR)
+    os.replace(BUILD_DIR, CHROMA_DIR)
+    client = chromadb.PersistentClient(
+        path=str(CHROMA_DIR),
+        settings=Settings(anonymized_telemetry=False)
     )
-    
-    print(f"   ✓ Added {len(ids)} documents to index")
+    collection = client.get_collection(name=COLLECTION_NAME)
     
     # Verify
-    print(f"\n[4/4] Verifying index...")
+    print(f"\n[3/3] Verifying index...")
     count = collection.count()
     print(f"   ✓ Index contains {count} documents")
     
@@ -125,8 +152,8 @@ def run_pipeline():
     print("=" * 70)
     print(f"\n📊 Results:")
     print(f"   • Documents indexed: {count}")
-    print(f"      - Read books:     {len(books_read)}")
-    print(f"      - Unread books:   {len(books_unread)}")
+    print(f"      - Read books:     {books_read}")
+    print(f"      - Unread books:   {books_unread}")
     print(f"   • Collection name:   {COLLECTION_NAME}")
     print(f"   • Similarity metric: cosine")
     print(f"\n📁 ChromaDB saved to: {CHROMA_DIR}")
@@ -12,25 +12,80 @@ Usage:
 
 Notes:
 - Add a clear User-Agent string. Open Library may block frequent anonymous traffic.
-- Be gentle with rate limiting. Start with 2 to 5 requests per second total.
+- Be gentle with rate limiting. Each host gets its own token bucket (--google_rps, --openlibrary_rps).
+- ISBNs are fetched concurrently (--concurrency, default 10) over one shared aiohttp session.
 """
 
 import argparse
+import asyncio
 import csv
 import json
 import os
+import random
 import re
 import time
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
-import requests
+import aiohttp
+import orjson
 
 
 GOOGLE_VOLUMES_URL = "https://www.googleapis.com/books/v1/volumes"
 OPENLIB_BOOKS_URL = "https://openlibrary.org/api/books"
 OPENLIB_COVERS_URL = "https://covers.openlibrary.org/b/isbn/{isbn}-{size}.jpg?default=false"
 
+GOOGLE_BATCH_SIZE = 15  # ISBNs per OR-joined Google Books query
+MAX_ATTEMPTS = 5  # Tries per request before a 429/5xx or network error is given up on
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # Transient; retried within the run
+QUOTA_STATUS = 403  # Google's quota/rate-limit exhaustion: not retried now, but not cached either
+BACKOFF_BASE = 0.5  # Seconds; retry n sleeps up to BACKOFF_BASE * 2**n (full jitter)
+BACKOFF_CAP = 30  # Seconds; upper bound on the exponential part of the backoff
+MIN_RATE = 0.1  # Requests/sec floor when backing off after 429s
+
+
+class AsyncTokenBucket:
+    """Per-host rate limiter: bursts of up to `capacity` requests, refilled at `rate` per second.
+
+    Capacity is at least 1 so a rate below 1/sec still lets one request through at a time.
+
+    `async with bucket:` waits for a token. On 429s the rate is halved and then
+    creeps back up towards the configured rate on successes (AIMD).
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.max_rate = rate
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.retries = 0  # Requests to this host that had to be retried
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def slow_down(self) -> None:
+        self.rate = max(MIN_RATE, self.rate / 2)
+
+    def speed_up(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+    async def __aenter__(self) -> "AsyncTokenBucket":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> bool:
+        return False
+
 
 def now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
@@ -52,20 +107,91 @@ def safe_get(d: Dict[str, Any], path: str, default=None):
     return cur
 
 
-def http_get_json(session: requests.Session, url: str, params: Dict[str, Any], timeout: int = 20) -> Dict[str, Any]:
-    r = session.get(url, params=params, timeout=timeout)
-    r.raise_for_status()
-    return r.json()
-
-
-def google_lookup(session: requests.Session, isbn: str) -> Optional[Dict[str, Any]]:
+def retry_after_seconds(headers: Any, default: float = 0.0) -> float:
+    try:
+        return max(0.0, float(headers.get("Retry-After", default)))
+    except ValueError:  # HTTP-date form
+        return default
+
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)]."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def is_permanent_error(status: Optional[int]) -> bool:
+    """4xx responses other than 429/403 (e.g. 400, 404) won't change on a rerun, so they are worth caching."""
+    return status is not None and 400 <= status < 500 and status not in RETRY_STATUSES and status != QUOTA_STATUS
+
+
+async def http_get_json(session: aiohttp.ClientSession, bucket: AsyncTokenBucket, url: str,
+                        params: Dict[str, Any], timeout: int = 20) -> Dict[str, Any]:
+    """GET a JSON document, retrying 429/5xx responses and network errors.
+
+    Each retry sleeps for a jittered exponential backoff, or longer if the server sent
+    Retry-After. Other HTTP errors, and the last failed attempt, raise.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        last_attempt = attempt == MAX_ATTEMPTS - 1
+        retry_after = 0.0
+        try:
+            async with bucket:
+                async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    if r.status in RETRY_STATUSES and not last_attempt:
+                        if r.status == 429:
+                            bucket.slow_down()
+                        retry_after = retry_after_seconds(r.headers)
+                    else:
+                        r.raise_for_status()
+                        bucket.speed_up()
+                        return await r.json(content_type=None)
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+        bucket.retries += 1
+        await asyncio.sleep(max(retry_after, backoff_delay(attempt)))
+
+
+async def google_lookup(session: aiohttp.ClientSession, bucket: AsyncTokenBucket, isbn: str) -> Optional[Dict[str, Any]]:
     # Query by ISBN
     params = {"q": f"isbn:{isbn}", "maxResults": 1, "printType": "books"}
-    data = http_get_json(session, GOOGLE_VOLUMES_URL, params=params)
+    data = await http_get_json(session, bucket, GOOGLE_VOLUMES_URL, params=params)
     items = data.get("items") or []
     if not items:
         return None
-    item = items[0]
+    return google_volume(items[0])
+
+
+async def google_lookup_batch(session: aiohttp.ClientSession, bucket: AsyncTokenBucket, isbns: List[str]) -> Dict[str, Any]:
+    """Look up several ISBNs with one OR-joined query; returns isbn -> volume for the ones found.
+
+    Items are matched back through their industryIdentifiers. If some items could not be
+    attributed, the result list was truncated, or a multi-ISBN query came back empty (in case
+    Google didn't parse the OR-joined query as expected), unmatched ISBNs get a single-ISBN
+    query; an ISBN whose single query fails maps to that exception instead of a volume.
+    """
+    params = {"q": " OR ".join(f"isbn:{i}" for i in isbns), "maxResults": len(isbns), "printType": "books"}
+    data = await http_get_json(session, bucket, GOOGLE_VOLUMES_URL, params=params)
+    items = data.get("items") or []
+    wanted = set(isbns)
+    found: Dict[str, Dict[str, Any]] = {}
+    unattributed = False
+    for item in items:
+        ids = {clean_isbn(x.get("identifier")) for x in safe_get(item, "volumeInfo.industryIdentifiers") or []}
+        hits = (ids & wanted) - found.keys()
+        for isbn in hits:
+            found[isbn] = google_volume(item)
+        unattributed |= not (ids & wanted)
+
+    missing = [i for i in isbns if i not in found]
+    truncated = (data.get("totalItems") or 0) > len(items)
+    if missing and (unattributed or truncated or (not items and len(isbns) > 1)):
+        singles = await asyncio.gather(*(google_lookup(session, bucket, i) for i in missing), return_exceptions=True)
+        found.update((i, g) for i, g in zip(missing, singles) if g)
+    return found
+
+
+def google_volume(item: Dict[str, Any]) -> Dict[str, Any]:
     info = item.get("volumeInfo") or {}
     return {
         "google_volume_id": item.get("id"),
@@ -79,11 +205,11 @@ def google_lookup(session: requests.Session, isbn: str) -> Optional[Dict[str, An
     }
 
 
-def openlibrary_lookup(session: requests.Session, isbn: str) -> Optional[Dict[str, Any]]:
+async def openlibrary_lookup(session: aiohttp.ClientSession, bucket: AsyncTokenBucket, isbn: str) -> Optional[Dict[str, Any]]:
     # jscmd=data gives richer fields
     bibkey = f"ISBN:{isbn}"
     params = {"bibkeys": bibkey, "format": "json", "jscmd": "data"}
-    data = http_get_json(session, OPENLIB_BOOKS_URL, params=params)
+    data = await http_get_json(session, bucket, OPENLIB_BOOKS_URL, params=params)
     entry = data.get(bibkey)
     if not entry:
         return None
@@ -110,37 +236,97 @@ def openlibrary_cover_url(isbn: str, size: str = "L") -> str:
     return OPENLIB_COVERS_URL.format(isbn=isbn, size=size)
 
 
-def url_exists(session: requests.Session, url: str, timeout: int = 15) -> bool:
+async def url_exists(session: aiohttp.ClientSession, bucket: AsyncTokenBucket, url: str, timeout: int = 15) -> bool:
     try:
-        r = session.head(url, timeout=timeout, allow_redirects=True)
-        return r.status_code == 200
+        async with bucket, session.head(url, timeout=aiohttp.ClientTimeout(total=timeout), allow_redirects=True) as r:
+            return r.status == 200
     except Exception:
         return False
 
 
 def load_cache(path: str) -> Dict[str, Any]:
+    """Read the JSONL cache (one payload per line, later lines win) into isbn -> payload.
+
+    An old single-object enrichment_cache.json next to it is imported on first run.
+    The file is rewritten compacted whenever it holds superseded or truncated lines.
+    """
+    cache: Dict[str, Any] = {}
+    lines = 0
     if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+        with open(path, "rb") as f:
+            for line in f:
+                lines += 1
+                try:
+                    entry = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    continue  # Partial line from an interrupted run
+                cache[entry["isbn"]] = entry
+    else:
+        legacy = os.path.splitext(path)[0] + ".json"
+        if legacy != path and os.path.exists(legacy):
+            with open(legacy, "rb") as f:
+                cache = orjson.loads(f.read())
+            lines = -1
+
+    if lines != len(cache):
+        save_cache(path, cache)
+    return cache
 
 
 def save_cache(path: str, cache: Dict[str, Any]) -> None:
+    """Write the whole cache as a fresh JSONL file (used for compaction)."""
     tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(cache, f, ensure_ascii=False, indent=2)
+    with open(tmp, "wb") as f:
+        for payload in cache.values():
+            f.write(orjson.dumps(payload) + b"\n")
     os.replace(tmp, path)
 
 
-def enrich_one(session: requests.Session, isbn: str) -> Dict[str, Any]:
-    isbn = clean_isbn(isbn)
+def append_cache(f, payload: Dict[str, Any]) -> None:
+    """Append one payload to the open JSONL cache; O(payload) instead of rewriting the file."""
+    f.write(orjson.dumps(payload) + b"\n")
+    f.flush()
+
+
+def error_payload(isbn: str, exc: BaseException) -> Dict[str, Any]:
+    """Cache-shaped record for a failed lookup; `status` is the HTTP status when there was one."""
+    return {"isbn": isbn, "error": str(exc), "status": getattr(exc, "status", None), "fetched_at": now_iso()}
+
+
+async def enrich_batch(session: aiohttp.ClientSession, buckets: Dict[str, AsyncTokenBucket], isbns: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Enrich a chunk of ISBNs: one batched Google query plus per-ISBN Open Library calls, all at once.
+
+    A failed provider call counts as "no data" from that provider, so the other one still fills
+    the record; the record then carries the failure's error/status (see fetch_all for caching).
+    """
+    g_batch, *ols = await asyncio.gather(
+        google_lookup_batch(session, buckets["google"], isbns),
+        *(openlibrary_lookup(session, buckets["openlibrary"], isbn) for isbn in isbns),
+        return_exceptions=True,
+    )
+    g_failed = isinstance(g_batch, Exception)
+    out: Dict[str, Dict[str, Any]] = {}
+    for isbn, ol in zip(isbns, ols):
+        # A failed batch query fails every ISBN; a failed single-ISBN fallback only its own
+        g = g_batch if g_failed else g_batch.get(isbn)
+        failures = [f for f in (g, ol) if isinstance(f, Exception)]
+        out[isbn] = await enrich_one(session, buckets, isbn, None if isinstance(g, Exception) else g,
+                                     None if isinstance(ol, Exception) else ol)
+        if failures:
+            # Report a transient failure over a permanent one so the record isn't cached
+            failure = next((f for f in failures if not is_permanent_error(getattr(f, "status", None))), failures[0])
+            out[isbn].update(error=str(failure), status=getattr(failure, "status", None))
+    return out
+
+
+async def enrich_one(session: aiohttp.ClientSession, buckets: Dict[str, AsyncTokenBucket], isbn: str,
+                     g: Optional[Dict[str, Any]], ol: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Build the cache record for one ISBN from its Google Books and Open Library lookups."""
     out: Dict[str, Any] = {"isbn": isbn, "fetched_at": now_iso()}
 
-    g = google_lookup(session, isbn)
     if g:
         out["google"] = g
 
-    ol = openlibrary_lookup(session, isbn)
     if ol:
         out["openlibrary"] = ol
 
@@ -167,74 +353,119 @@ def enrich_one(session: requests.Session, isbn: str) -> Dict[str, Any]:
     cover_url = None
     cover_source = None
 
-    # Prefer Open Library covers by ISBN when it exists
-    ol_cover = openlibrary_cover_url(isbn, "L")
-    if url_exists(session, ol_cover):
-        cover_url = ol_cover
+    # Prefer Open Library covers; the jscmd=data record already lists them when they exist
+    links = (g or {}).get("imageLinks") or {}
+    if ol and (ol.get("cover") or {}).get("large"):
+        cover_url = ol["cover"]["large"]
         cover_source = "open_library_covers"
-    else:
-        # Fallback to Google Books imageLinks
-        if g:
-            links = g.get("imageLinks") or {}
-            # Prefer larger if present
-            cover_url = links.get("thumbnail") or links.get("smallThumbnail")
-            if cover_url:
-                cover_source = "google_books"
+    elif links.get("thumbnail") or links.get("smallThumbnail"):
+        # Fallback to Google Books imageLinks, preferring the larger one
+        cover_url = links.get("thumbnail") or links.get("smallThumbnail")
+        cover_source = "google_books"
+    elif ol is None:
+        # No Open Library record to go on: last resort, probe the covers API by ISBN
+        ol_cover = openlibrary_cover_url(isbn, "L")
+        if await url_exists(session, buckets["covers"], ol_cover):
+            cover_url = ol_cover
+            cover_source = "open_library_covers"
 
     out["cover_image_url"] = cover_url
     out["cover_source"] = cover_source
     return out
 
 
+async def fetch_all(isbns: List[str], cache: Dict[str, Any], args: argparse.Namespace) -> Dict[str, Any]:
+    """Enrich `isbns` in chunks of GOOGLE_BATCH_SIZE, at most args.concurrency chunks in flight.
+
+    Returns isbn -> payload. Successful lookups and permanent 4xx failures also go into `cache`
+    and are appended to the cache file as they complete (fsynced every args.flush_every entries).
+    """
+    fetched: Dict[str, Any] = {}
+    sem = asyncio.Semaphore(args.concurrency)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    # One bucket per host; Open Library (and its covers host) is the stricter one
+    buckets = {
+        "google": AsyncTokenBucket(args.google_rps, args.google_rps),
+        "openlibrary": AsyncTokenBucket(args.openlibrary_rps, args.openlibrary_rps),
+        "covers": AsyncTokenBucket(args.openlibrary_rps, args.openlibrary_rps),
+    }
+
+    with open(args.cache, "ab") as cache_file:
+        async with aiohttp.ClientSession(headers={"User-Agent": args.user_agent}, connector=connector) as session:
+            async def fetch(chunk: List[str]) -> Dict[str, Dict[str, Any]]:
+                async with sem:
+                    try:
+                        return await enrich_batch(session, buckets, chunk)
+                    except Exception as e:
+                        return {isbn: error_payload(isbn, e) for isbn in chunk}
+
+            chunks = [isbns[i:i + GOOGLE_BATCH_SIZE] for i in range(0, len(isbns), GOOGLE_BATCH_SIZE)]
+            tasks = [asyncio.create_task(fetch(chunk)) for chunk in chunks]
+            appended = 0
+            for done in asyncio.as_completed(tasks):
+                for isbn, payload in (await done).items():
+                    fetched[isbn] = payload
+                    # Transient failures stay out of the cache so a rerun tries them again
+                    if "error" not in payload or is_permanent_error(payload.get("status")):
+                        cache[isbn] = payload
+                        append_cache(cache_file, payload)
+                        appended += 1
+                        if appended % args.flush_every == 0:
+                            os.fsync(cache_file.fileno())
+                    if len(fetched) % 100 == 0:
+                        print(f"Processed {len(fetched)}/{len(isbns)}")
+            os.fsync(cache_file.fileno())
+
+    failed = [p for p in fetched.values() if "error" in p]
+    permanent = sum(is_permanent_error(p.get("status")) for p in failed)
+    print("Retries: " + ", ".join(f"{name} {bucket.retries}" for name, bucket in buckets.items()))
+    print(f"Failed: {len(failed)} ISBNs ({permanent} permanent, cached; {len(failed) - permanent} transient, retried next run)")
+    return fetched
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--queue", required=True, help="CSV of rows to enrich. Must include book_key and isbn columns.")
-    ap.add_argument("--books", required=True, help="Your book_records CSV to update.")
+    ap.add_argument("--books", required=True, help="Your book_records CSV (or .parquet) to update.")
     ap.add_argument("--out", required=True, help="Output enriched book_records CSV.")
-    ap.add_argument("--cache", default="enrichment_cache.json", help="Path to JSON cache.")
-    ap.add_argument("--sleep", type=float, default=0.35, help="Seconds to sleep between requests. Tune up if you hit rate limits.")
+    ap.add_argument("--cache", default="enrichment_cache.jsonl", help="Path to JSONL cache (an old enrichment_cache.json is imported).")
+    ap.add_argument("--flush_every", type=int, default=50, help="fsync the cache file every N new entries.")
+    ap.add_argument("--google_rps", type=float, default=5, help="Max Google Books requests per second.")
+    ap.add_argument("--openlibrary_rps", type=float, default=2, help="Max Open Library requests per second (applied to the data and covers hosts separately).")
+    ap.add_argument("--concurrency", type=int, default=10, help=f"Max ISBN chunks ({GOOGLE_BATCH_SIZE} each) fetched at once.")
     ap.add_argument("--user_agent", default="AIWithZachBookEnricher/1.0 (contact: you@example.com)", help="User-Agent header.")
     args = ap.parse_args()
+    if args.google_rps <= 0 or args.openlibrary_rps <= 0:
+        ap.error("--google_rps and --openlibrary_rps must be positive")
 
     cache = load_cache(args.cache)
 
-    session = requests.Session()
-    session.headers.update({"User-Agent": args.user_agent})
-
-    # Read queue
-    queue_rows = []
-    with open(args.queue, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            queue_rows.append(row)
-
-    results: Dict[str, Any] = {}
-
-    for i, row in enumerate(queue_rows, start=1):
-        book_key = row.get("book_key") or ""
-        isbn = clean_isbn(row.get("isbn") or "")
-        if not isbn:
-            # You can add a title+author fallback here later, but ISBN-based is most reliable.
-            continue
-
-        if isbn in cache:
-            results[book_key] = cache[isbn]
-        else:
-            try:
-                enriched = enrich_one(session, isbn)
-                cache[isbn] = enriched
-                results[book_key] = enriched
-                save_cache(args.cache, cache)
-            except Exception as e:
-                results[book_key] = {"isbn": isbn, "error": str(e), "fetched_at": now_iso()}
-            time.sleep(args.sleep)
-
-        if i % 100 == 0:
-            print(f"Processed {i}/{len(queue_rows)}")
+    # Read queue as (book_key, cleaned isbn) pairs; each ISBN is cleaned once
+    with open(args.queue, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        bk_i, isbn_i = header.index("book_key"), header.index("isbn")
+        queue_rows = [(row[bk_i], clean_isbn(row[isbn_i])) for row in reader if row]
+
+    # Dedupe up front so each uncached ISBN is fetched once (dict keeps queue order)
+    unique_isbns = dict.fromkeys(isbn for _, isbn in queue_rows if isbn)
+    pending = [isbn for isbn in unique_isbns if isbn not in cache]
+    print(f"{len(unique_isbns)} unique ISBNs in queue, {len(pending)} to fetch")
+    fetched = asyncio.run(fetch_all(pending, cache, args))
+
+    # Join queue rows back to their ISBN's payload
+    # (rows without an ISBN are skipped; a title+author fallback could go here later)
+    results: Dict[str, Any] = {
+        book_key: cache[isbn] if isbn in cache else fetched[isbn]
+        for book_key, isbn in queue_rows if isbn
+    }
 
     # Load books and update
     import pandas as pd
-    books = pd.read_csv(args.books, low_memory=False)
+    if args.books.endswith(".parquet"):
+        books = pd.read_parquet(args.books)
+    else:
+        books = pd.read_csv(args.books, low_memory=False)
 
     # Create mapping frames
     rows_out = []
@@ -258,10 +489,6 @@ def main():
     merged = books.merge(enriched_df, how="left", on="book_key")
 
     # Fill description if missing or short
-    def is_missing_desc(x: Any) -> bool:
-        s = "" if pd.isna(x) else str(x)
-        return len(s.strip()) < 80
-
     if "description_raw" not in merged.columns:
         merged["description_raw"] = ""
 
@@ -271,19 +498,15 @@ def main():
     if "cover_image_source" not in merged.columns:
         merged["cover_image_source"] = ""
 
-    mask_desc = merged["description_raw"].apply(is_missing_desc) & (merged["description_new"].fillna("").astype(str).str.len() >= 80)
+    mask_desc = (merged["description_raw"].fillna("").astype(str).str.strip().str.len() < 80) & (merged["description_new"].fillna("").astype(str).str.len() >= 80)
     merged.loc[mask_desc, "description_raw"] = merged.loc[mask_desc, "description_new"]
     merged.loc[mask_desc, "description_source"] = merged.loc[mask_desc, "description_source_new"].fillna("")
 
     # Fill cover if missing
-    def is_missing_cover(x: Any) -> bool:
-        s = "" if pd.isna(x) else str(x)
-        return len(s.strip()) == 0
-
     if "cover_image_url" not in merged.columns:
         merged["cover_image_url"] = ""
 
-    mask_cover = merged["cover_image_url"].apply(is_missing_cover) & (merged["cover_image_url_new"].fillna("").astype(str).str.len() > 0)
+    mask_cover = (merged["cover_image_url"].fillna("").astype(str).str.strip().str.len() == 0) & (merged["cover_image_url_new"].fillna("").astype(str).str.len() > 0)
     merged.loc[mask_cover, "cover_image_url"] = merged.loc[mask_cover, "cover_image_url_new"]
     merged.loc[mask_cover, "cover_image_source"] = merged.loc[mask_cover, "cover_source_new"].fillna("")
 
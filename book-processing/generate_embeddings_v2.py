@@ -6,7 +6,9 @@ Model: all-MiniLM-L6-v2 (384 dimensions, fast, quality balance)
 """
 import pandas as pd
 import numpy as np
+import hashlib
 import json
+import orjson
 from pathlib import Path
 from tqdm import tqdm
 
@@ -15,24 +17,96 @@ SCRIPT_DIR = Path(__file__).parent
 DATA_DIR = SCRIPT_DIR.parent / 'data'
 INPUT_FILE = SCRIPT_DIR / 'book_records_v4_enriched.csv'
 OUTPUT_FILE = DATA_DIR / 'library_with_embeddings.json'
+EMBEDDINGS_FILE = DATA_DIR / 'library_embeddings.npy'  # int8 unit vectors; row i belongs to EMBEDDING_IDS_FILE[i]
+EMBEDDING_NORMS_FILE = DATA_DIR / 'library_embedding_norms.npy'  # fp16 L2 norm per row
+EMBEDDING_IDS_FILE = DATA_DIR / 'library_embedding_ids.json'
+LIBRARY_PARQUET_FILE = DATA_DIR / 'library.parquet'  # Book metadata, no vectors; embedding_row indexes EMBEDDINGS_FILE
 MODEL_NAME = 'all-MiniLM-L6-v2'
+ENCODE_BATCH_SIZE = 256  # MiniLM-L6 is small; big batches amortize per-batch overhead
+EMBEDDING_CACHE_FILE = SCRIPT_DIR / 'embedding_cache.npz'  # text hash -> vector, reused across runs
+JSON_CHUNK_SIZE = 1000  # Records converted to dicts at a time while streaming OUTPUT_FILE
+YEAR_PATTERN = r'\b((?:19|20)\d{2})\b'  # First 19xx/20xx year in free-form date text
 
-def safe_year(val):
-    """Safely convert year to int, handling various formats."""
-    if pd.isna(val):
-        return None
+def parse_years(s):
+    """Vectorized year parsing: numeric values truncate to int, anything else
+    yields its first 19xx/20xx; None when neither applies."""
+    years = pd.to_numeric(s, errors='coerce')
+    years = years.where(np.isfinite(years))
+    unparsed = years.isna() & s.notna()
+    years.loc[unparsed] = pd.to_numeric(s[unparsed].astype(str).str.extract(YEAR_PATTERN, expand=False))
+    return int_or_none(years)
+
+def text_or(s, default):
+    """str(x) for present values, `default` for missing ones (object dtype, ready for JSON)."""
+    return s.astype(str).astype(object).where(s.notna(), default)
+
+def int_or_none(s):
+    """int(x) for present values, None for missing ones (object dtype, ready for JSON)."""
+    ints = np.trunc(pd.to_numeric(s)).astype('Int64').astype(object)
+    return ints.where(ints.notna(), None)
+
+def genres_json(val):
+    """Normalize a genres_list cell to a JSON array string ('[]' when empty or unparseable)."""
     try:
-        # Try direct float->int conversion
-        return int(float(val))
-    except (ValueError, TypeError):
-        # Handle date strings or other formats
-        val_str = str(val)
-        # Extract first 4-digit year if present
-        import re
-        match = re.search(r'\b(19|20)\d{2}\b', val_str)
-        if match:
-            return int(match.group())
-        return None
+        genres = json.loads(val) if isinstance(val, str) else val
+    except ValueError:
+        return '[]'
+    if not isinstance(genres, list) or not genres:
+        return '[]'
+    return json.dumps(genres)
+
+def build_book_columns(df):
+    """Vectorized per-book output fields (everything except description and embedding)."""
+    missing = pd.Series(np.nan, index=df.index)
+    return pd.DataFrame({
+        'id': df['book_key'].astype(str),
+        'title': text_or(df['title'], ''),
+        'author': text_or(df['author'], ''),
+        'isbn': text_or(df.get('isbn', missing), ''),
+        'my_rating': df['my_rating'].fillna(0).astype(int),
+        'avg_rating': df['avg_rating'].astype(float).astype(object).where(df['avg_rating'].notna(), 0),
+        'shelf': np.where(df['is_read'], 'read', 'unread'),
+        'is_read': df['is_read'].astype(bool),
+        'date_read': text_or(df['date_read'], None),
+        'pages': int_or_none(df.get('pages', missing)),
+        'year_published': parse_years(df['publish_year']),
+        'description': '',
+        'genres': df.get('genres_list', missing).map(genres_json),
+        'genre_primary': text_or(df.get('genre_primary', missing), 'Unknown'),
+        'cover_url': text_or(df['cover_image_url'], None),
+        'popularity_score': df['popularity_score'].fillna(0).astype(int),
+    })
+
+def text_key(text):
+    """Cache key for an embedding input text."""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+def load_embedding_cache():
+    """Load the text-hash -> vector cache (empty if missing or built with another model)."""
+    if not EMBEDDING_CACHE_FILE.exists():
+        return {}
+    with np.load(EMBEDDING_CACHE_FILE) as data:
+        if str(data['model']) != MODEL_NAME:
+            return {}
+        return dict(zip(data['keys'].tolist(), data['vecs']))
+
+def save_embedding_cache(cache):
+    np.savez_compressed(
+        EMBEDDING_CACHE_FILE,
+        model=MODEL_NAME,
+        keys=np.array(list(cache)),
+        vecs=np.stack(list(cache.values())),
+    )
+
+def quantize_embeddings(matrix):
+    """Quantize embeddings to int8 unit vectors plus fp16 norms (~4x smaller than fp32).
+    
+    Dequantize with: q.astype(np.float32) / 127 * norms[:, None]
+    """
+    norms = np.linalg.norm(matrix, axis=1)
+    unit = matrix / np.where(norms > 0, norms, 1)[:, None]
+    q = np.round(unit * 127).astype(np.int8)
+    return q, norms.astype(np.float16)
 
 def run_pipeline():
     print("=" * 70)
@@ -48,21 +122,20 @@ def run_pipeline():
     
     # Filter to books with descriptions
     # Use description_for_embedding if available, else description_clean
-    if 'description_for_embedding' in df.columns:
-        df_with_desc = df[df['description_for_embedding'].notna() & (df['description_for_embedding'].str.len() > 50)].copy()
-        embedding_col = 'description_for_embedding'
-    else:
-        df_with_desc = df[df['description_clean'].notna() & (df['description_clean'].str.len() > 50)].copy()
-        embedding_col = 'description_clean'
+    embedding_col = 'description_for_embedding' if 'description_for_embedding' in df.columns else 'description_clean'
+    has_desc = df[embedding_col].notna() & (df[embedding_col].str.len() > 50)
+    df_with_desc = df[has_desc]
     
     print(f"   ✓ {len(df_with_desc)} books have descriptions for embedding")
     
     # Load model
     print(f"\n[2/4] Loading Sentence Transformer model: {MODEL_NAME}")
+    import torch
     from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer(MODEL_NAME)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = SentenceTransformer(MODEL_NAME, device=device)
     embedding_dim = model.get_sentence_embedding_dimension()
-    print(f"   ✓ Model loaded (embedding dimension: {embedding_dim})")
+    print(f"   ✓ Model loaded on {device} (embedding dimension: {embedding_dim})")
     
     # Get embedding texts
     print(f"\n[3/4] Preparing texts for embedding...")
@@ -73,104 +146,92 @@ def run_pipeline():
     print(f"\n[4/4] Generating embeddings...")
     print(f"   (This may take a few minutes for {len(texts)} books)")
     
-    # Batch encode for efficiency
-    embeddings = model.encode(
-        texts,
-        batch_size=32,
-        show_progress_bar=True,
-        convert_to_numpy=True
-    )
+    # Only texts not seen in a previous run are encoded
+    keys = [text_key(t) for t in texts]
+    cached = load_embedding_cache()
+    new_texts = {k: t for k, t in zip(keys, texts) if k not in cached}
+    hits = sum(k in cached for k in keys)
+    print(f"   ✓ {hits} texts already cached, encoding {len(new_texts)} new ones")
+    
+    if new_texts:
+        # Batch encode for efficiency (encode() already length-sorts texts into batches).
+        # Unit-normalized, so cosine similarity downstream is a plain dot product;
+        # fp16 halves the matrix, far below any difference cosine ranking can see
+        new_embeddings = model.encode(
+            list(new_texts.values()),
+            batch_size=ENCODE_BATCH_SIZE,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float16)
+        cached.update(zip(new_texts, new_embeddings))
+    
+    embeddings = np.stack([cached[k] for k in keys]) if keys else np.empty((0, embedding_dim), np.float16)
+    # Keep only this run's texts so the cache doesn't grow without bound
+    if keys:
+        save_embedding_cache({k: cached[k] for k in keys})
     
     print(f"   ✓ Generated {len(embeddings)} embeddings")
     
-    # Prepare output data
-    output_data = []
-    
-    # Books with embeddings
-    for idx, (_, row) in enumerate(df_with_desc.iterrows()):
-        # Parse genres
-        genres_str = row.get('genres_list', '[]')
-        try:
-            genres = json.loads(genres_str) if isinstance(genres_str, str) else genres_str
-        except:
-            genres = []
-        
-        book_data = {
-            'id': str(row['book_key']),
-            'title': str(row['title']) if pd.notna(row['title']) else '',
-            'author': str(row['author']) if pd.notna(row['author']) else '',
-            'isbn': str(row.get('isbn', '')) if pd.notna(row.get('isbn')) else '',
-            'my_rating': int(row['my_rating']) if pd.notna(row['my_rating']) else 0,
-            'avg_rating': float(row['avg_rating']) if pd.notna(row['avg_rating']) else 0,
-            'shelf': 'read' if row['is_read'] else 'unread',
-            'is_read': bool(row['is_read']),
-            'date_read': str(row['date_read']) if pd.notna(row['date_read']) else None,
-            'pages': int(row.get('pages', 0)) if pd.notna(row.get('pages')) else None,
-            'year_published': safe_year(row['publish_year']),
-            'description': str(row['description_clean']) if pd.notna(row['description_clean']) else '',
-            'genres': json.dumps(genres) if genres else '[]',
-            'genre_primary': str(row.get('genre_primary', 'Unknown')) if pd.notna(row.get('genre_primary')) else 'Unknown',
-            'cover_url': str(row['cover_image_url']) if pd.notna(row['cover_image_url']) else None,
-            'popularity_score': int(row['popularity_score']) if pd.notna(row['popularity_score']) else 0,
-            'embedding': embeddings[idx].tolist(),
-            'embedding_text': str(row[embedding_col]) if pd.notna(row[embedding_col]) else ''
-        }
-        output_data.append(book_data)
-    
-    # Books WITHOUT descriptions (for completeness)
-    df_no_desc = df[~df.index.isin(df_with_desc.index)]
-    for _, row in df_no_desc.iterrows():
-        genres_str = row.get('genres_list', '[]')
-        try:
-            genres = json.loads(genres_str) if isinstance(genres_str, str) else genres_str
-        except:
-            genres = []
-        
-        book_data = {
-            'id': str(row['book_key']),
-            'title': str(row['title']) if pd.notna(row['title']) else '',
-            'author': str(row['author']) if pd.notna(row['author']) else '',
-            'isbn': str(row.get('isbn', '')) if pd.notna(row.get('isbn')) else '',
-            'my_rating': int(row['my_rating']) if pd.notna(row['my_rating']) else 0,
-            'avg_rating': float(row['avg_rating']) if pd.notna(row['avg_rating']) else 0,
-            'shelf': 'read' if row['is_read'] else 'unread',
-            'is_read': bool(row['is_read']),
-            'date_read': str(row['date_read']) if pd.notna(row['date_read']) else None,
-            'pages': int(row.get('pages', 0)) if pd.notna(row.get('pages')) else None,
-            'year_published': safe_year(row['publish_year']),
-            'description': '',
-            'genres': json.dumps(genres) if genres else '[]',
-            'genre_primary': str(row.get('genre_primary', 'Unknown')) if pd.notna(row.get('genre_primary')) else 'Unknown',
-            'cover_url': str(row['cover_image_url']) if pd.notna(row['cover_image_url']) else None,
-            'popularity_score': int(row['popularity_score']) if pd.notna(row['popularity_score']) else 0,
-            'embedding': None,  # No embedding for books without descriptions
-            'embedding_text': None
-        }
-        output_data.append(book_data)
-    
-    # Save to JSON
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2)
+    # Save embeddings as a quantized binary sidecar for Python consumers (mmap-loadable)
+    q, norms = quantize_embeddings(embeddings.astype(np.float32))
+    np.save(EMBEDDINGS_FILE, q)
+    np.save(EMBEDDING_NORMS_FILE, norms)
+    with open(EMBEDDING_IDS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(df_with_desc['book_key'].astype(str).tolist(), f)
+    
+    # Build the output columns for all books at once: books with embeddings
+    # first (row i <-> embeddings[i]), then books without descriptions
+    ordered = pd.concat([df_with_desc, df[~has_desc]])
+    books = build_book_columns(ordered)
+    books['description'] = text_or(ordered['description_clean'], '').where(has_desc, '')
+    
+    # Stream the JSON records chunk by chunk, attaching the vectors and embedding text
+    # (None for books without embeddings), so the full list of dicts never exists at once.
+    # Still one JSON array for the frontend, just one compact record per line.
+    embedding_texts = text_or(df_with_desc[embedding_col], '').tolist()
+    with open(OUTPUT_FILE, 'wb') as f:
+        f.write(b'[')
+        separator = b'\n'
+        for start in range(0, len(books), JSON_CHUNK_SIZE):
+            records = books.iloc[start:start + JSON_CHUNK_SIZE].to_dict('records')
+            for row, book in enumerate(records, start):
+                has_embedding = row < len(embeddings)
+                book['embedding'] = embeddings[row].tolist() if has_embedding else None
+                book['embedding_text'] = embedding_texts[row] if has_embedding else None
+                f.write(separator)
+                f.write(orjson.dumps(book))
+                separator = b',\n'
+        f.write(b'\n]\n')
+    
+    # Columnar copy of the metadata for Python consumers; vectors stay in the .npy sidecar.
+    # Written after the JSON so readers can tell it is at least as fresh as the JSON.
+    metadata = books.assign(embedding_row=pd.array(
+        list(range(len(df_with_desc))) + [None] * (len(books) - len(df_with_desc)), dtype='Int64'
+    ))
+    metadata.astype({'pages': 'Int64', 'year_published': 'Int64'}).to_parquet(
+        LIBRARY_PARQUET_FILE, engine='pyarrow', compression='zstd', index=False
+    )
     
     # Stats
-    books_with_embeddings = len([b for b in output_data if b['embedding'] is not None])
-    books_read = len([b for b in output_data if b['is_read']])
-    books_unread = len([b for b in output_data if not b['is_read']])
+    books_with_embeddings = len(df_with_desc)
+    books_read = int(books['is_read'].sum())
+    books_unread = len(books) - books_read
     
     print("\n" + "=" * 70)
     print("✅ Embedding Generation Complete!")
     print("=" * 70)
     print(f"\n📊 Results:")
-    print(f"   • Total books:        {len(output_data)}")
+    print(f"   • Total books:        {len(books)}")
     print(f"   • With embeddings:    {books_with_embeddings}")
-    print(f"   • Without embeddings: {len(output_data) - books_with_embeddings}")
+    print(f"   • Without embeddings: {len(books) - books_with_embeddings}")
     print(f"   • Read books:         {books_read}")
     print(f"   • Unread books:       {books_unread}")
     print(f"   • Embedding model:    {MODEL_NAME}")
     print(f"   • Embedding dimension: {embedding_dim}")
     print(f"\n📁 Output saved to: {OUTPUT_FILE}")
-    
-    return output_data
+    print(f"📁 Embedding matrix saved to: {EMBEDDINGS_FILE}")
+    print(f"📁 Metadata saved to: {LIBRARY_PARQUET_FILE}")
 
 if __name__ == "__main__":
     run_pipeline()
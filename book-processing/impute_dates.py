@@ -4,19 +4,16 @@ Impute missing read dates for books in series based on when other books in that
 This updates the raw Goodreads CSV before the main pipeline runs.
 """
 
+import bisect
 import pandas as pd
 import re
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 INPUT_FILE = '/Users/zachstanford/Development/smart-books-ai/data/goodreads_library_export.csv'
 OUTPUT_FILE = '/Users/zachstanford/Development/smart-books-ai/data/goodreads_library_export.csv'
 
-def extract_series_info(title):
-    """Extract series name and book number from title like 'Book Title (Series Name, #3)'"""
-    match = re.search(r'\(([^,]+),\s*#?(\d+(?:\.\d+)?)\)$', title)
-    if match:
-        return match.group(1).strip(), float(match.group(2))
-    return None, None
+# Matches a trailing "(Series Name, #3)" in a title
+_SERIES_RE = re.compile(r'\(([^,]+?),\s*#?(\d+(?:\.\d+)?)\)$')
 
 def main():
     print("=" * 70)
@@ -35,23 +32,28 @@ def main():
     print(f"   Missing date_read: {len(missing_dates)}")
     
     # Extract series info
-    read_books['series_name'], read_books['series_num'] = zip(
-        *read_books['Title'].apply(extract_series_info)
-    )
+    extracted = read_books['Title'].str.extract(_SERIES_RE.pattern)
+    read_books['series_name'] = extracted[0].str.strip()
+    read_books['series_num'] = pd.to_numeric(extracted[1], errors='coerce')
     
     # Group by series and find date patterns
     series_books = read_books[read_books['series_name'].notna()]
     series_with_dates = series_books[series_books['Date Read'].notna()]
+    # Parse the known read dates once; unparseable dates become NaT and are skipped
+    series_with_dates = series_with_dates.assign(read_date=pd.to_datetime(
+        series_with_dates['Date Read'], format='%Y/%m/%d', errors='coerce', cache=True
+    ))
     
     print(f"\n[2/4] Finding series patterns...")
     
-    # Create series date lookup
+    # Create series date lookup: series -> (sorted book numbers, matching dates)
     series_dates = {}
     for series in series_with_dates['series_name'].unique():
         series_data = series_with_dates[series_with_dates['series_name'] == series]
-        dates = series_data[['series_num', 'Date Read']].values.tolist()
+        dates = series_data[['series_num', 'read_date']].values.tolist()
         if dates:
-            series_dates[series] = sorted(dates, key=lambda x: x[0])
+            nums, read_dates = zip(*sorted(dates, key=lambda x: x[0]))
+            series_dates[series] = (list(nums), list(read_dates))
     
     print(f"   Found {len(series_dates)} series with date patterns")
     
@@ -64,42 +66,40 @@ def main():
         if pd.isna(row['Date Read']) and row['series_name'] in series_dates:
             series = row['series_name']
             book_num = row['series_num']
-            known_dates = series_dates[series]
+            nums, dates = series_dates[series]
             
-            # Find closest known date and estimate
-            closest_date = None
-            min_diff = float('inf')
-            closest_num = None
+            # Find closest known date and estimate (nums is sorted, so only
+            # the neighbours around the insertion point can be closest)
+            i = bisect.bisect_left(nums, book_num)
+            candidates = [j for j in (i - 1, i) if 0 <= j < len(nums)]
+            closest_idx = min(candidates, key=lambda j: abs(nums[j] - book_num))
+            # On repeated numbers prefer the first one, like a linear scan would
+            closest_idx = bisect.bisect_left(nums, nums[closest_idx])
+            closest_num = nums[closest_idx]
+            closest_date = dates[closest_idx]
             
-            for num, date_str in known_dates:
-                diff = abs(num - book_num)
-                if diff < min_diff:
-                    min_diff = diff
-                    closest_date = date_str
-                    closest_num = num
-            
-            if closest_date:
-                # Parse date and adjust based on book number difference
-                try:
-                    base_date = datetime.strptime(closest_date, '%Y/%m/%d')
-                    # Estimate ~30 days per book in series
-                    days_diff = int((book_num - closest_num) * 30)
-                    imputed_date = base_date + timedelta(days=days_diff)
-                    imputed_str = imputed_date.strftime('%Y/%m/%d')
-                    
-                    # Update the dataframe
-                    df.loc[df['Title'] == row['Title'], 'Date Read'] = imputed_str
-                    imputed_count += 1
-                    imputed_books.append({
-                        'title': row['Title'][:50],
-                        'series': series,
-                        'imputed_date': imputed_str,
-                        'based_on': f"#{closest_num} read {closest_date}"
-                    })
-                except:
-                    pass
+            if pd.notna(closest_date):
+                # Adjust the known date based on book number difference
+                # Estimate ~30 days per book in series
+                days_diff = int((book_num - closest_num) * 30)
+                imputed_date = closest_date + timedelta(days=days_diff)
+                imputed_str = imputed_date.strftime('%Y/%m/%d')
+                
+                # Update the dataframe
+                df.at[idx, 'Date Read'] = imputed_str
+                imputed_count += 1
+                imputed_books.append({
+                    'title': row['Title'][:50],
+                    'series': series,
+                    'imputed_date': imputed_str,
+                    'based_on': f"#{closest_num} read {closest_date.strftime('%Y/%m/%d')}"
+                })
     
     # Also handle non-series books - impute based on rating pattern or mark as "estimated"
+    # Known reading-sequence dates are collected as {index: date} and written in one go;
+    # read_books shares df's index, so each row is checked in place rather than by title
+    sequence_updates = {}
+    
     # For Harry Potter specifically
     hp_missing = read_books[
         (read_books['Title'].str.contains('Harry Potter', case=False)) & 
@@ -118,8 +118,8 @@ def main():
         elif 'Deathly Hallows' in title:  # HP7
             imputed = '2017/11/01'  # After HP6
         
-        if imputed and df.loc[df['Title'] == title, 'Date Read'].isna().any():
-            df.loc[df['Title'] == title, 'Date Read'] = imputed
+        if imputed and pd.isna(df.at[idx, 'Date Read']):
+            sequence_updates[idx] = imputed
             imputed_count += 1
             imputed_books.append({
                 'title': title[:50],
@@ -148,8 +148,8 @@ def main():
         elif 'Last Battle' in title:  # Book 7
             imputed = '2021/06/01'  # After Horse/Boy
         
-        if imputed and df.loc[df['Title'] == title, 'Date Read'].isna().any():
-            df.loc[df['Title'] == title, 'Date Read'] = imputed
+        if imputed and pd.isna(df.at[idx, 'Date Read']):
+            sequence_updates[idx] = imputed
             imputed_count += 1
             imputed_books.append({
                 'title': title[:50],
@@ -158,6 +158,9 @@ def main():
                 'based_on': 'Narnia reading sequence'
             })
     
+    if sequence_updates:
+        df.loc[list(sequence_updates), 'Date Read'] = pd.Series(sequence_updates)
+    
     print(f"   ✓ Imputed {imputed_count} dates")
     
     for book in imputed_books:
@@ -6,12 +6,19 @@ Impute missing genres for books based on:
 3. Known author genres
 """
 
+import hashlib
 import json
 import re
+import shutil
+from functools import lru_cache
 from pathlib import Path
 
+import ahocorasick
+import orjson
+
 DATA_DIR = Path(__file__).parent.parent / 'data'
 PUBLIC_DATA_DIR = Path(__file__).parent.parent / 'public' / 'data'
+GENRE_CACHE_FILE = Path(__file__).parent / 'genre_cache.json'  # (author, title) hash -> imputation, reused across runs
 
 # Genre keyword patterns for imputation
 GENRE_KEYWORDS = {
@@ -94,6 +101,23 @@ GENRE_KEYWORDS = {
     ]
 }
 
+
+def build_keyword_automaton():
+    """Aho-Corasick automaton over all GENRE_KEYWORDS; each keyword maps to its genres."""
+    keyword_genres = {}
+    for genre, keywords in GENRE_KEYWORDS.items():
+        for keyword in keywords:
+            keyword_genres.setdefault(keyword.lower(), []).append(genre)
+    automaton = ahocorasick.Automaton()
+    for keyword, genres in keyword_genres.items():
+        automaton.add_word(keyword, tuple(genres))
+    automaton.make_automaton()
+    return automaton
+
+
+# Built once; scans a title for every keyword in a single pass
+KEYWORD_AUTOMATON = build_keyword_automaton()
+
 # Fiction vs Nonfiction classification
 NONFICTION_GENRES = {
     'Business', 'Self-Help', 'Psychology', 'Philosophy', 'Biography', 'History',
@@ -108,6 +132,10 @@ FICTION_GENRES = {
     'Historical Fiction', 'Literary Fiction', 'Adventure', 'Action'
 }
 
+# Lowercased once for the substring checks in classify_fiction_nonfiction
+NONFICTION_GENRES_LOWER = tuple(g.lower() for g in NONFICTION_GENRES)
+FICTION_GENRES_LOWER = tuple(g.lower() for g in FICTION_GENRES)
+
 # Known author genres
 AUTHOR_GENRES = {
     'Malcolm Gladwell': ['Nonfiction', 'Psychology', 'Business'],
@@ -158,15 +186,33 @@ AUTHOR_GENRES = {
 }
 
 
+def build_author_index():
+    """Index AUTHOR_GENRES by lowercased last name -> [(position, first name, genres)]."""
+    index = {}
+    for order, (known_author, genres) in enumerate(AUTHOR_GENRES.items()):
+        known_parts = known_author.lower().split()
+        index.setdefault(known_parts[-1], []).append((order, known_parts[0], genres))
+    return index
+
+
+AUTHORS_BY_LAST_NAME = build_author_index()
+
+# Splits an author string into name words ("Covey, Stephen R." -> covey, stephen, r.)
+AUTHOR_WORD_SPLIT = re.compile(r"[\s,;&()/]+")
+
+
 def classify_fiction_nonfiction(genres):
     """Classify a book as Fiction or Nonfiction based on genres"""
     if not genres:
         return 'Unknown'
     
-    nonfiction_count = sum(1 for g in genres if g in NONFICTION_GENRES or 
-                          any(ng.lower() in g.lower() for ng in NONFICTION_GENRES))
-    fiction_count = sum(1 for g in genres if g in FICTION_GENRES or
-                       any(fg.lower() in g.lower() for fg in FICTION_GENRES))
+    nonfiction_count = 0
+    fiction_count = 0
+    for g in genres:
+        # Exact set hit first; only then fall back to the substring scan
+        g_lower = g.lower()
+        nonfiction_count += g in NONFICTION_GENRES or any(ng in g_lower for ng in NONFICTION_GENRES_LOWER)
+        fiction_count += g in FICTION_GENRES or any(fg in g_lower for fg in FICTION_GENRES_LOWER)
     
     if nonfiction_count > fiction_count:
         return 'Nonfiction'
@@ -176,16 +222,25 @@ def classify_fiction_nonfiction(genres):
         return 'Unknown'
 
 
+@lru_cache(maxsize=None)
+def parse_genres_str(genres_str):
+    """Parse a JSON genres string; most books share a handful of values, so each is parsed once.
+    
+    The returned list is shared between callers and must not be mutated.
+    """
+    try:
+        return json.loads(genres_str)
+    except json.JSONDecodeError:
+        return []
+
+
 def impute_genre_from_keywords(title, existing_genres=None):
     """Impute genre based on title keywords"""
     title_lower = title.lower()
     imputed_genres = set(existing_genres or [])
     
-    for genre, keywords in GENRE_KEYWORDS.items():
-        for keyword in keywords:
-            if keyword.lower() in title_lower:
-                imputed_genres.add(genre)
-                break
+    for _, genres in KEYWORD_AUTOMATON.iter(title_lower):
+        imputed_genres.update(genres)
     
     return list(imputed_genres)
 
@@ -196,17 +251,16 @@ def impute_genre_from_author(author):
     if author in AUTHOR_GENRES:
         return AUTHOR_GENRES[author]
     
-    # Check partial match (for variations like "Stephen R. Covey" vs "Stephen Covey")
-    author_lower = author.lower()
-    for known_author, genres in AUTHOR_GENRES.items():
-        # Get last name
-        known_parts = known_author.lower().split()
-        if known_parts[-1] in author_lower:
-            # Check if first name also matches
-            if known_parts[0] in author_lower:
-                return genres
-    
-    return []
+    # Check partial match (for variations like "Stephen R. Covey" vs "Stephen Covey"):
+    # a known author's last and first name both appear as words; earliest entry wins
+    words = set(AUTHOR_WORD_SPLIT.split(author.lower()))
+    matches = [
+        (order, genres)
+        for word in words
+        for order, first_name, genres in AUTHORS_BY_LAST_NAME.get(word, ())
+        if first_name in words
+    ]
+    return min(matches, key=lambda m: m[0])[1] if matches else []
 
 
 def get_primary_genre(genres, is_nonfiction=None):
@@ -238,17 +292,62 @@ def get_primary_genre(genres, is_nonfiction=None):
         return genres[0] if genres else 'Unknown'
 
 
+def impute_missing_genres(author, title):
+    """Impute genres for a book without any: author mapping first, then title keywords.
+    
+    Returns (genres, source) where source is 'author', 'keywords' or None.
+    """
+    imputed_genres = []
+    source = None
+    
+    # Try author-based imputation
+    author_genres = impute_genre_from_author(author)
+    if author_genres:
+        imputed_genres.extend(author_genres)
+        source = 'author'
+    
+    # Try keyword-based imputation
+    keyword_genres = impute_genre_from_keywords(title, imputed_genres)
+    if len(keyword_genres) > len(imputed_genres):
+        imputed_genres = keyword_genres
+        if not author_genres:
+            source = 'keywords'
+    
+    return imputed_genres, source
+
+
+def imputation_key(author, title):
+    """Cache key for a book's imputation inputs."""
+    return hashlib.blake2b(f"{author}\0{title}".encode('utf-8'), digest_size=16).hexdigest()
+
+
+def rules_fingerprint():
+    """Hash of the keyword and author tables, so edits to them invalidate the cache."""
+    return hashlib.blake2b(orjson.dumps([GENRE_KEYWORDS, AUTHOR_GENRES]), digest_size=16).hexdigest()
+
+
+def load_genre_cache():
+    """Load the imputation cache (empty if missing or built with other rules)."""
+    if not GENRE_CACHE_FILE.exists():
+        return {}
+    cache = orjson.loads(GENRE_CACHE_FILE.read_bytes())
+    if cache.get('rules') != rules_fingerprint():
+        return {}
+    return cache['books']
+
+
+def save_genre_cache(books):
+    GENRE_CACHE_FILE.write_bytes(orjson.dumps({'rules': rules_fingerprint(), 'books': books}))
+
+
 def main():
     print("=" * 70)
     print("📚 Genre Imputation for Read Books")
     print("=" * 70)
     
     # Load data
-    with open(PUBLIC_DATA_DIR / 'library_with_embeddings.json', 'r') as f:
-        books = json.load(f)
-    
-    with open(PUBLIC_DATA_DIR / 'galaxy_coordinates.json', 'r') as f:
-        galaxy = json.load(f)
+    books = orjson.loads((PUBLIC_DATA_DIR / 'library_with_embeddings.json').read_bytes())
+    galaxy = orjson.loads((PUBLIC_DATA_DIR / 'galaxy_coordinates.json').read_bytes())
     
     # Create lookup for galaxy data
     galaxy_lookup = {b['id']: i for i, b in enumerate(galaxy)}
@@ -262,38 +361,32 @@ def main():
         'still_missing': 0,
     }
     
+    genre_cache = load_genre_cache()
+    used_keys = set()
+    
     # Process each book
     for book in books:
         if not book.get('is_read'):
             continue
         
         stats['total_read'] += 1
-        existing_genres = book.get('genres', [])
-        
+        existing_genres = book.get('genres')
         if isinstance(existing_genres, str):
-            try:
-                existing_genres = json.loads(existing_genres)
-            except:
-                existing_genres = []
+            existing_genres = parse_genres_str(existing_genres)
         
-        if existing_genres and len(existing_genres) > 0:
+        if existing_genres:
             stats['had_genres'] += 1
             imputed_genres = existing_genres
         else:
-            imputed_genres = []
-            
-            # Try author-based imputation
-            author_genres = impute_genre_from_author(book.get('author', ''))
-            if author_genres:
-                imputed_genres.extend(author_genres)
-                stats['imputed_from_author'] += 1
-            
-            # Try keyword-based imputation
-            keyword_genres = impute_genre_from_keywords(book.get('title', ''), imputed_genres)
-            if len(keyword_genres) > len(imputed_genres):
-                imputed_genres = keyword_genres
-                if not author_genres:
-                    stats['imputed_from_keywords'] += 1
+            # Same author and title as a previous run: reuse its imputation
+            author, title = book.get('author', ''), book.get('title', '')
+            key = imputation_key(author, title)
+            if key not in genre_cache:
+                genre_cache[key] = impute_missing_genres(author, title)
+            used_keys.add(key)
+            imputed_genres, source = genre_cache[key]
+            if source:
+                stats[f'imputed_from_{source}'] += 1
         
         # Classify as fiction/nonfiction
         fiction_class = classify_fiction_nonfiction(imputed_genres)
@@ -317,19 +410,14 @@ def main():
         if not imputed_genres:
             stats['still_missing'] += 1
     
-    # Save updated data
-    with open(PUBLIC_DATA_DIR / 'library_with_embeddings.json', 'w') as f:
-        json.dump(books, f, indent=2)
-    
-    with open(PUBLIC_DATA_DIR / 'galaxy_coordinates.json', 'w') as f:
-        json.dump(galaxy, f, indent=2)
-    
-    # Also save to data folder
-    with open(DATA_DIR / 'library_with_embeddings.json', 'w') as f:
-        json.dump(books, f, indent=2)
+    # Keep only this run's books so the cache doesn't grow without bound
+    save_genre_cache({key: genre_cache[key] for key in used_keys})
     
-    with open(DATA_DIR / 'galaxy_coordinates.json', 'w') as f:
-        json.dump(galaxy, f, indent=2)
+    # Save updated data (compact; these are the large files), serializing each once
+    # and copying the file to the data folder
+    for name, data in (('library_with_embeddings.json', books), ('galaxy_coordinates.json', galaxy)):
+        (PUBLIC_DATA_DIR / name).write_bytes(orjson.dumps(data))
+        shutil.copyfile(PUBLIC_DATA_DIR / name, DATA_DIR / name)
     
     # Print results
     print(f"\n[Results]")
@@ -6,9 +6,12 @@ Includes both read and unread books in visualizations.
 """
 import json
 import numpy as np
+import orjson
 import pandas as pd
 from pathlib import Path
 from collections import Counter
+from functools import lru_cache
+from itertools import chain
 from datetime import datetime
 import ast
 
@@ -18,14 +21,50 @@ DATA_DIR = SCRIPT_DIR.parent / 'data'
 INPUT_FILE = DATA_DIR / 'library_with_embeddings.json'
 OUTPUT_FILE = DATA_DIR / 'analytics_data.json'
 GALAXY_OUTPUT = DATA_DIR / 'galaxy_coordinates.json'
+GALAXY_COORDS_FILE = DATA_DIR / 'galaxy_coords.npz'  # float32 copy of the coordinates; row i belongs to ids[i]
+# Written by generate_embeddings_v2.py; used instead of INPUT_FILE when at least as new
+LIBRARY_PARQUET_FILE = DATA_DIR / 'library.parquet'  # embedding_row indexes EMBEDDINGS_FILE
+EMBEDDINGS_FILE = DATA_DIR / 'library_embeddings.npy'
+EMBEDDING_NORMS_FILE = DATA_DIR / 'library_embedding_norms.npy'
+ANALYTICS_COLUMNS = ['is_read', 'date_read', 'genres', 'my_rating', 'author']  # Read by the charts
+UMAP_EXACT_KNN_LIMIT = 4096  # UMAP computes exact neighbors below this many points
+
+# Galaxy point metadata -> default for books without the field
+GALAXY_DEFAULTS = {
+    'id': None,
+    'title': None,
+    'author': None,
+    'my_rating': 0,
+    'avg_rating': 0,
+    'shelf': 'unread',
+    'is_read': False,
+    'date_read': None,
+    'cover_url': None,
+    'genres': '[]',
+    'genre_primary': 'Unknown',
+    'pages': None,
+    'year_published': None,
+    'popularity_score': 0,
+}
+GALAXY_COLUMNS = list(GALAXY_DEFAULTS) + ['num_ratings', 'x', 'y', 'z', 'x2d', 'y2d']
 
 def parse_genres(genres_str):
     """Parse genres string to list."""
+    if isinstance(genres_str, str):
+        return _parse_genres_str(genres_str)
+    if isinstance(genres_str, list):
+        return genres_str
+    return []
+
+@lru_cache(maxsize=None)
+def _parse_genres_str(genres_str):
+    """Many books share the same genres string, so each distinct one is parsed once.
+    
+    Callers must not mutate the returned list; it is shared between them.
+    """
     if not genres_str or genres_str == '[]':
         return []
     try:
-        if isinstance(genres_str, list):
-            return genres_str
         return json.loads(genres_str)
     except:
         try:
@@ -33,19 +72,49 @@ def parse_genres(genres_str):
         except:
             return []
 
-def parse_date(date_str):
-    """Parse date string to datetime object."""
-    if not date_str:
-        return None
-    try:
-        # Format: 2025/12/28
-        return datetime.strptime(date_str, '%Y/%m/%d')
-    except:
-        try:
-            # Try alternate formats
-            return datetime.strptime(date_str, '%Y-%m-%d')
-        except:
-            return None
+def parse_dates(s):
+    """Vectorized date parsing: 2025/12/28 or 2025-12-28, NaT for anything else."""
+    dates = pd.to_datetime(s, format='%Y/%m/%d', errors='coerce')
+    return dates.fillna(pd.to_datetime(s, format='%Y-%m-%d', errors='coerce'))
+
+def normalize_coords(coords):
+    """Scale each column to [-1, 1] in one pass; constant columns are left as is."""
+    min_val, max_val = coords.min(axis=0), coords.max(axis=0)
+    spread = np.where(max_val > min_val, max_val - min_val, 1)
+    return np.where(max_val > min_val, 2 * (coords - min_val) / spread - 1, coords)
+
+def sidecar_is_fresh():
+    """True when library.parquet and the embeddings sidecar exist and aren't older than the JSON."""
+    sidecar_files = (LIBRARY_PARQUET_FILE, EMBEDDINGS_FILE, EMBEDDING_NORMS_FILE)
+    if not all(path.exists() for path in sidecar_files):
+        return False
+    return LIBRARY_PARQUET_FILE.stat().st_mtime >= INPUT_FILE.stat().st_mtime
+
+def load_library(source):
+    """Load the books plus the float32 UMAP input for the ones with embeddings.
+    
+    Returns (books, books_with_embeddings, embeddings). Books carry no vectors
+    when read from library.parquet; the int8 sidecar is dequantized instead of
+    parsing millions of floats out of the JSON.
+    """
+    if source == LIBRARY_PARQUET_FILE:
+        metadata = pd.read_parquet(LIBRARY_PARQUET_FILE)
+        embedding_row = metadata.pop('embedding_row')
+        books = metadata.astype(object).where(metadata.notna(), None).to_dict(orient='records')
+        has_embedding = embedding_row.notna().to_numpy()
+        rows = embedding_row[has_embedding].to_numpy(dtype=np.int64)
+        q = np.load(EMBEDDINGS_FILE, mmap_mode='r')
+        norms = np.load(EMBEDDING_NORMS_FILE, mmap_mode='r')
+        embeddings = q[rows].astype(np.float32) / 127 * norms[rows, None].astype(np.float32)
+        books_with_embeddings = [b for b, keep in zip(books, has_embedding) if keep]
+        return books, books_with_embeddings, embeddings
+    
+    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+        books = json.load(f)
+    books_with_embeddings = [b for b in books if b.get('embedding') is not None]
+    # float32 is what UMAP works in anyway; skip the float64 intermediate
+    embeddings = np.asarray([b['embedding'] for b in books_with_embeddings], dtype=np.float32)
+    return books, books_with_embeddings, embeddings
 
 def run_pipeline():
     print("=" * 70)
@@ -54,23 +123,21 @@ def run_pipeline():
     
     # Load data
     print(f"\n[1/5] Loading library data...")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        books = json.load(f)
-    print(f"   ✓ Loaded {len(books)} books")
+    source = LIBRARY_PARQUET_FILE if sidecar_is_fresh() else INPUT_FILE
+    books, books_with_embeddings, embeddings = load_library(source)
+    print(f"   ✓ Loaded {len(books)} books from {source.name}")
     
-    # Convert to DataFrame for easier analysis
-    df = pd.DataFrame(books)
+    # Convert to DataFrame for easier analysis (only the chart columns, never the embeddings)
+    df = pd.DataFrame(books, columns=ANALYTICS_COLUMNS)
     
     # --- CHART 1: Reading Timeline ---
     print(f"\n[2/5] Computing reading timeline...")
     read_books = df[(df['is_read'] == True) & (df['date_read'].notna())].copy()
-    read_books['date_parsed'] = read_books['date_read'].apply(parse_date)
-    read_books = read_books[read_books['date_parsed'].notna()]
+    read_books['date_parsed'] = parse_dates(read_books['date_read'])
+    read_books = read_books.dropna(subset=['date_parsed'])
     
     if len(read_books) > 0:
-        read_books['year_month'] = read_books['date_parsed'].apply(
-            lambda x: x.strftime('%Y-%m') if x else None
-        )
+        read_books['year_month'] = read_books['date_parsed'].dt.strftime('%Y-%m')
         timeline = read_books.groupby('year_month').size().reset_index(name='count')
         timeline = timeline.sort_values('year_month')
         reading_timeline = timeline.to_dict(orient='records')
@@ -80,12 +147,9 @@ def run_pipeline():
     
     # --- CHART 2: Genre Breakdown ---
     print(f"\n[3/5] Computing genre breakdown...")
-    all_genres = []
-    for genres_str in df['genres']:
-        genres = parse_genres(genres_str)
-        all_genres.extend(genres[:3])  # Top 3 genres per book
-    
-    genre_counts = Counter(all_genres)
+    genre_counts = Counter(chain.from_iterable(
+        parse_genres(genres_str)[:3] for genres_str in df['genres'].tolist()  # Top 3 genres per book
+    ))
     top_genres = genre_counts.most_common(12)
     genre_breakdown = [{'genre': g, 'count': c} for g, c in top_genres]
     print(f"   ✓ Found {len(genre_counts)} unique genres, showing top 12")
@@ -103,75 +167,69 @@ def run_pipeline():
     
     # --- GALAXY VIEW: 3D Coordinates via UMAP ---
     print(f"\n[5/5] Computing 3D coordinates for Galaxy View...")
-    books_with_embeddings = [b for b in books if b.get('embedding') is not None]
     
     if len(books_with_embeddings) > 10:
         import umap
+        from umap.umap_ import nearest_neighbors
+        
+        n_neighbors = min(15, len(books_with_embeddings) - 1)
         
-        embeddings = np.array([b['embedding'] for b in books_with_embeddings])
+        # Past UMAP_EXACT_KNN_LIMIT books UMAP approximates the k-NN graph with
+        # NN-descent; build that once and share it between the 3D and 2D reducers.
+        # Below it UMAP's exact pairwise path is cheaper than compiling NN-descent.
+        knn = (None, None, None)
+        if len(embeddings) >= UMAP_EXACT_KNN_LIMIT:
+            knn = nearest_neighbors(
+                embeddings,
+                n_neighbors=n_neighbors,
+                metric='cosine',
+                metric_kwds=None,
+                angular=True,
+                random_state=np.random.RandomState(42)
+            )
         
         # UMAP to 3D
         reducer = umap.UMAP(
             n_components=3,
-            n_neighbors=min(15, len(books_with_embeddings) - 1),
+            n_neighbors=n_neighbors,
             min_dist=0.1,
             metric='cosine',
-            random_state=42
+            random_state=42,
+            precomputed_knn=knn
         )
         coords_3d = reducer.fit_transform(embeddings)
         
         # Normalize to [-1, 1] range for Three.js
-        for dim in range(3):
-            min_val = coords_3d[:, dim].min()
-            max_val = coords_3d[:, dim].max()
-            if max_val > min_val:
-                coords_3d[:, dim] = 2 * (coords_3d[:, dim] - min_val) / (max_val - min_val) - 1
+        coords_3d = normalize_coords(coords_3d)
         
         # Also compute 2D for fallback
         reducer_2d = umap.UMAP(
             n_components=2,
-            n_neighbors=min(15, len(books_with_embeddings) - 1),
+            n_neighbors=n_neighbors,
             min_dist=0.1,
             metric='cosine',
-            random_state=42
+            random_state=42,
+            precomputed_knn=knn
         )
         coords_2d = reducer_2d.fit_transform(embeddings)
         
         # Normalize 2D
-        for dim in range(2):
-            min_val = coords_2d[:, dim].min()
-            max_val = coords_2d[:, dim].max()
-            if max_val > min_val:
-                coords_2d[:, dim] = 2 * (coords_2d[:, dim] - min_val) / (max_val - min_val) - 1
+        coords_2d = normalize_coords(coords_2d)
         
-        galaxy_data = []
-        for i, book in enumerate(books_with_embeddings):
-            galaxy_data.append({
-                'id': book['id'],
-                'title': book['title'],
-                'author': book['author'],
-                'my_rating': book.get('my_rating', 0),
-                'avg_rating': book.get('avg_rating', 0),
-                'shelf': book.get('shelf', 'unread'),
-                'is_read': book.get('is_read', False),
-                'date_read': book.get('date_read'),
-                'cover_url': book.get('cover_url'),
-                'genres': parse_genres(book.get('genres', '[]'))[:3],
-                'genre_primary': book.get('genre_primary', 'Unknown'),
-                'pages': book.get('pages'),
-                'year_published': book.get('year_published'),
-                'popularity_score': book.get('popularity_score', 0),
-                'num_ratings': book.get('popularity_score', 0),  # Same as popularity_score for display
-                'x': float(coords_3d[i, 0]),
-                'y': float(coords_3d[i, 1]),
-                'z': float(coords_3d[i, 2]),
-                'x2d': float(coords_2d[i, 0]),
-                'y2d': float(coords_2d[i, 1])
-            })
+        # Metadata columns for every book at once (missing fields take the defaults),
+        # then the coordinates as whole columns
+        meta = pd.DataFrame(books_with_embeddings, columns=list(GALAXY_DEFAULTS), dtype=object)
+        meta = meta.fillna({k: v for k, v in GALAXY_DEFAULTS.items() if v is not None})
+        meta = meta.where(meta.notna(), None)
+        meta['genres'] = [parse_genres(g)[:3] for g in meta['genres']]
+        meta['num_ratings'] = meta['popularity_score']  # Same as popularity_score for display
+        meta[['x', 'y', 'z']] = coords_3d
+        meta[['x2d', 'y2d']] = coords_2d
+        galaxy_data = meta[GALAXY_COLUMNS].to_dict(orient='records')
         
         # Count read vs unread
-        read_count = len([b for b in galaxy_data if b['is_read']])
-        unread_count = len([b for b in galaxy_data if not b['is_read']])
+        read_count = sum(1 for b in galaxy_data if b['is_read'])
+        unread_count = len(galaxy_data) - read_count
         print(f"   ✓ Generated 3D coordinates for {len(galaxy_data)} books")
         print(f"      - Read:   {read_count}")
         print(f"      - Unread: {unread_count}")
@@ -183,7 +241,7 @@ def run_pipeline():
     total_books = len(df)
     books_read = len(df[df['is_read'] == True])
     books_unread = len(df[df['is_read'] == False])
-    books_with_desc = len([b for b in books if b.get('description')])
+    books_with_desc = sum(1 for b in books if b.get('description'))
     five_star_books = len(df[(df['is_read'] == True) & (df['my_rating'] == 5)])
     
     # Top authors (from read books)
@@ -216,13 +274,23 @@ def run_pipeline():
         'shelf_summary': shelf_summary
     }
     
-    # Save analytics
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(analytics, f, indent=2)
+    # Save analytics (small, kept human-readable)
+    OUTPUT_FILE.write_bytes(orjson.dumps(analytics, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
     
-    # Save galaxy data separately (larger file)
-    with open(GALAXY_OUTPUT, 'w', encoding='utf-8') as f:
-        json.dump(galaxy_data, f, indent=2)
+    # Save galaxy data separately (larger file, compact)
+    GALAXY_OUTPUT.write_bytes(orjson.dumps(galaxy_data, option=orjson.OPT_SERIALIZE_NUMPY))
+    
+    # Binary copy of the coordinates for Python consumers; the frontend keeps reading the JSON
+    if galaxy_data:
+        np.savez_compressed(
+            GALAXY_COORDS_FILE,
+            ids=np.array([p['id'] for p in galaxy_data]),
+            coords_3d=coords_3d.astype(np.float32),
+            coords_2d=coords_2d.astype(np.float32)
+        )
+    else:
+        # No UMAP this run: don't leave a previous run's coordinates looking current
+        GALAXY_COORDS_FILE.unlink(missing_ok=True)
     
     print("\n" + "=" * 70)
     print("✅ Analytics Pre-computation Complete!")
@@ -236,6 +304,8 @@ def run_pipeline():
     print(f"   • Data coverage:    {books_with_desc}/{total_books} ({books_with_desc/total_books*100:.1f}%)")
     print(f"\n📁 Analytics saved to: {OUTPUT_FILE}")
     print(f"📁 Galaxy data saved to: {GALAXY_OUTPUT}")
+    if galaxy_data:
+        print(f"📁 Galaxy coordinates (binary) saved to: {GALAXY_COORDS_FILE}")
     
     return analytics, galaxy_data
 
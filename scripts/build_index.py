@@ -13,6 +13,16 @@ DATA_DIR = Path(__file__).parent.parent / 'data'
 INPUT_FILE = DATA_DIR / 'library_with_embeddings.json'
 CHROMA_DIR = DATA_DIR / 'chroma_db'
 COLLECTION_NAME = 'smart_books'
+BATCH_SIZE = 5000  # Books per collection.add()
+HNSW_LARGE_CORPUS = 10000  # From this many books, build a denser HNSW graph
+
+def hnsw_metadata(n_books):
+    """Collection metadata: cosine space plus HNSW build params sized to the corpus."""
+    if n_books >= HNSW_LARGE_CORPUS:
+        m, construction_ef = 32, 200
+    else:
+        m, construction_ef = 16, 100
+    return {"hnsw:space": "cosine", "hnsw:M": m, "hnsw:construction_ef": construction_ef}
 
 def run_pipeline():
     print("=" * 60)
@@ -46,7 +56,7 @@ def run_pipeline():
     # Create collection
     collection = client.create_collection(
         name=COLLECTION_NAME,
-        metadata={"hnsw:space": "cosine"}  # Use cosine similarity
+        metadata=hnsw_metadata(len(books_with_embeddings))  # Use cosine similarity
     )
     print(f"   ✓ Created collection: {COLLECTION_NAME}")
     
@@ -79,13 +89,16 @@ def run_pipeline():
             'series': book['series'] or ''
         })
     
-    # Batch insert (ChromaDB handles batching internally)
-    collection.add(
-        ids=ids,
-        embeddings=embeddings,
-        documents=documents,
-        metadatas=metadatas
-    )
+    # Insert in explicit chunks: keeps each call under Chroma's max batch size
+    for start in range(0, len(ids), BATCH_SIZE):
+        end = start + BATCH_SIZE
+        collection.add(
+            ids=ids[start:end],
+            embeddings=embeddings[start:end],
+            documents=documents[start:end],
+            metadatas=metadatas[start:end]
+        )
+        print(f"      … {min(end, len(ids))} indexed")
     
     print(f"   ✓ Added {len(ids)} documents to index")
     
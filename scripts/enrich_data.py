@@ -4,56 +4,86 @@ Stage 1: Data Enrichment Pipeline
 Joins Goodreads library export with Kaggle Best Books metadata.
 Uses waterfall strategy: ISBN match first, then Title+Author fallback.
 """
+import ast
+import json
 import pandas as pd
 import re
 import sys
 from pathlib import Path
 
+# --- COMPILED PATTERNS ---
+# Compiled once at import and handed to the .str methods as is
+
+# Excel ="..." wrapping and whitespace around ISBNs
+ISBN_JUNK_PATTERN = re.compile(r'[="\s]')
+# Everything from the first comma or parenthesis (co-authors, illustrators)
+EXTRA_AUTHORS_PATTERN = re.compile(r'[,(].*', re.DOTALL)
+# Title normalization for matching
+PUNCTUATION_PATTERN = re.compile(r'[^\w\s]')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
 # --- CONFIGURATION ---
 DATA_DIR = Path(__file__).parent.parent / 'data'
 USER_FILE = DATA_DIR / 'goodreads_library_export.csv'
 METADATA_FILE = DATA_DIR / 'books_1.Best_Books_Ever.csv'
 OUTPUT_FILE = DATA_DIR / 'enriched_library.csv'
+OUTPUT_PARQUET_FILE = OUTPUT_FILE.with_suffix('.parquet')  # Same rows, typed + columnar
 
 # --- HELPERS ---
-def clean_isbn(val):
-    """Standardizes ISBNs by stripping non-numeric chars and Excel formatting."""
-    if pd.isna(val): 
-        return None
-    # Remove Excel formatting: ="1234567890" -> 1234567890
-    cleaned = re.sub(r'[=""\s]', '', str(val)).strip()
-    # Return None if empty or too short
-    if len(cleaned) < 10:
-        return None
-    return cleaned
+def clean_isbns(values):
+    """Standardizes a column of ISBNs by stripping Excel formatting and whitespace.
+    
+    ="1234567890" -> 1234567890; None if missing, empty or too short.
+    """
+    cleaned = values.astype('string').str.replace(ISBN_JUNK_PATTERN, '', regex=True)
+    return cleaned.astype(object).where(cleaned.str.len().fillna(0) >= 10, None)
 
-def normalize_author(name):
-    """Converts 'Last, First' to 'First Last' for better matching."""
-    if pd.isna(name): 
-        return ""
-    name = str(name).strip()
-    if "," in name:
-        parts = name.split(",", 1)
-        return f"{parts[1].strip()} {parts[0].strip()}"
-    return name
+def normalize_authors(names):
+    """Converts 'Last, First' to 'First Last' for better matching ("" if missing)."""
+    names = names.astype('string').str.strip()
+    # reindex: split() yields a single column when no name has a comma
+    parts = names.str.split(',', n=1, expand=True).reindex(columns=[0, 1]).astype('string')
+    swapped = parts[1].str.strip() + ' ' + parts[0].str.strip()
+    return swapped.where(parts[1].notna(), names).fillna('').astype(object)
 
-def clean_kaggle_author(author):
-    """Cleans Kaggle author field (may have illustrators, etc.)."""
-    if pd.isna(author):
-        return ""
-    # Take first author only (before comma or parenthesis)
-    author = str(author).split(',')[0].split('(')[0].strip()
-    return author
+def clean_kaggle_authors(authors):
+    """Cleans the Kaggle author column (may have illustrators, etc.): first author only."""
+    # Keep everything before the first comma or parenthesis
+    first = authors.astype('string').str.replace(EXTRA_AUTHORS_PATTERN, '', regex=True).str.strip()
+    return first.fillna('').astype(object)
 
-def normalize_title(title):
-    """Normalizes title for fuzzy matching."""
-    if pd.isna(title):
-        return ""
+def normalize_titles(titles):
+    """Normalizes a title column for fuzzy matching ("" if missing)."""
     # Lowercase, remove special chars, collapse whitespace
-    title = str(title).lower()
-    title = re.sub(r'[^\w\s]', '', title)
-    title = re.sub(r'\s+', ' ', title).strip()
-    return title
+    titles = (
+        titles.astype('string')
+        .str.lower()
+        .str.replace(PUNCTUATION_PATTERN, '', regex=True)
+        .str.replace(WHITESPACE_PATTERN, ' ', regex=True)
+        .str.strip()
+    )
+    return titles.fillna('').astype(object)
+
+def parse_genres(genres_str):
+    """Parse a genres string like "['Fantasy', 'Fiction']" to a list.
+    
+    A list of plain strings is valid JSON once its quotes are swapped, and json.loads
+    is much faster than ast; strings with quotes or escapes inside, or anything that
+    doesn't come back as a list of strings, go through ast.literal_eval as before.
+    """
+    if pd.isna(genres_str):
+        return []
+    if isinstance(genres_str, str) and '"' not in genres_str and '\\' not in genres_str:
+        try:
+            genres = json.loads(genres_str.replace("'", '"'))
+            if isinstance(genres, list) and all(isinstance(g, str) for g in genres):
+                return genres
+        except ValueError:
+            pass
+    try:
+        return ast.literal_eval(genres_str)
+    except:
+        return []
 
 # --- EXECUTION ---
 def run_pipeline():
@@ -74,13 +104,13 @@ def run_pipeline():
     
     # Standardization
     print(f"\n[2/5] Standardizing ISBNs and Authors...")
-    goodreads['ISBN13_clean'] = goodreads['ISBN13'].apply(clean_isbn)
-    goodreads['Author_clean'] = goodreads['Author'].apply(normalize_author)
-    goodreads['Title_norm'] = goodreads['Title'].apply(normalize_title)
+    goodreads['ISBN13_clean'] = clean_isbns(goodreads['ISBN13'])
+    goodreads['Author_clean'] = normalize_authors(goodreads['Author'])
+    goodreads['Title_norm'] = normalize_titles(goodreads['Title'])
     
-    kaggle['isbn_clean'] = kaggle['isbn'].apply(clean_isbn)
-    kaggle['author_clean'] = kaggle['author'].apply(clean_kaggle_author)
-    kaggle['title_norm'] = kaggle['title'].apply(normalize_title)
+    kaggle['isbn_clean'] = clean_isbns(kaggle['isbn'])
+    kaggle['author_clean'] = clean_kaggle_authors(kaggle['author'])
+    kaggle['title_norm'] = normalize_titles(kaggle['title'])
     
     isbn_count = goodreads['ISBN13_clean'].notna().sum()
     print(f"   ✓ {isbn_count}/{len(goodreads)} books have valid ISBN13")
@@ -89,13 +119,9 @@ def run_pipeline():
     print(f"\n[3/5] Pass 1: ISBN13 matching...")
     kaggle_cols = ['isbn_clean', 'description', 'genres', 'coverImg', 'series', 'pages', 'rating']
     
-    merged = pd.merge(
-        goodreads,
-        kaggle[kaggle_cols].drop_duplicates(subset=['isbn_clean']),
-        left_on='ISBN13_clean',
-        right_on='isbn_clean',
-        how='left'
-    )
+    # Join against Kaggle indexed by ISBN (no duplicate key column in the result)
+    kaggle_by_isbn = kaggle[kaggle_cols].drop_duplicates(subset=['isbn_clean']).set_index('isbn_clean')
+    merged = goodreads.join(kaggle_by_isbn, on='ISBN13_clean', how='left')
     
     isbn_matches = merged['description'].notna().sum()
     print(f"   ✓ Matched {isbn_matches} books via ISBN")
@@ -105,30 +131,26 @@ def run_pipeline():
     
     # Identify rows that failed Pass 1
     mask_missed = merged['description'].isna()
-    missing = merged[mask_missed].drop(
-        columns=['description', 'genres', 'coverImg', 'series', 'pages', 'rating', 'isbn_clean'],
-        errors='ignore'
-    )
-    found = merged[~mask_missed]
+    missing = merged.loc[mask_missed, ['Title_norm', 'Author_clean']]
     
     # Prepare fallback dataset (unique title/author pairs from Kaggle)
     kaggle_unique = kaggle.drop_duplicates(subset=['title_norm', 'author_clean'])
     
-    # Fallback join
-    missing_filled = pd.merge(
-        missing,
-        kaggle_unique[['title_norm', 'author_clean', 'description', 'genres', 'coverImg', 'series', 'pages', 'rating']],
-        left_on=['Title_norm', 'Author_clean'],
-        right_on=['title_norm', 'author_clean'],
-        how='left'
-    )
+    # Fallback join: the missed books are the small side, so look each one up in a
+    # (title, author) -> Kaggle row dict instead of merging (-1 = no match -> NaN row)
+    fallback_cols = ['description', 'genres', 'coverImg', 'series', 'pages', 'rating']
+    row_by_key = dict(zip(zip(kaggle_unique['title_norm'], kaggle_unique['author_clean']), range(len(kaggle_unique))))
+    rows = [row_by_key.get(key, -1) for key in zip(missing['Title_norm'], missing['Author_clean'])]
+    fallback = kaggle_unique[fallback_cols].reset_index(drop=True).reindex(rows)
     
-    title_matches = missing_filled['description'].notna().sum()
+    # Replace the missed rows' Kaggle columns in place, so the books keep their Goodreads order
+    merged.loc[mask_missed, fallback_cols] = fallback.set_axis(missing.index)
+    
+    title_matches = merged.loc[mask_missed, 'description'].notna().sum()
     print(f"   ✓ Matched {title_matches} additional books via Title+Author")
     
-    # Final Merge & Cleanup
+    # Final Cleanup
     print(f"\n[5/5] Finalizing enriched dataset...")
-    final_df = pd.concat([found, missing_filled], ignore_index=True)
     
     # Select columns for app
     app_columns = [
@@ -139,24 +161,16 @@ def run_pipeline():
     ]
     
     # Keep only columns that exist
-    cols_to_keep = [c for c in app_columns if c in final_df.columns]
-    final_df = final_df[cols_to_keep]
+    cols_to_keep = [c for c in app_columns if c in merged.columns]
+    final_df = merged.loc[:, cols_to_keep]
     
     # Clean up genres field (convert string representation of list to actual list)
-    def parse_genres(genres_str):
-        if pd.isna(genres_str):
-            return []
-        try:
-            # Parse string like "['Fantasy', 'Fiction']"
-            import ast
-            return ast.literal_eval(genres_str)
-        except:
-            return []
-    
     final_df['genres_list'] = final_df['genres'].apply(parse_genres)
     
-    # Export
+    # Export (CSV for compatibility, Parquet for fast downstream reads; written
+    # second so generate_embeddings can tell it is at least as fresh as the CSV)
     final_df.to_csv(OUTPUT_FILE, index=False)
+    final_df.to_parquet(OUTPUT_PARQUET_FILE, engine='pyarrow', compression='zstd', index=False)
     
     # Validation Stats
     coverage = final_df['description'].notna().mean()
@@ -171,6 +185,7 @@ def run_pipeline():
     print(f"   • ISBN matches:       {isbn_matches}")
     print(f"   • Title+Author:       {title_matches}")
     print(f"\n📁 Output saved to: {OUTPUT_FILE}")
+    print(f"📁 Parquet copy saved to: {OUTPUT_PARQUET_FILE}")
     
     return final_df
 
@@ -4,6 +4,7 @@ Stage 2: Embedding Generation
 Generates vector embeddings for book descriptions using Sentence Transformers.
 Model: all-MiniLM-L6-v2 (384 dimensions, fast, quality balance)
 """
+import ast
 import pandas as pd
 import numpy as np
 import json
@@ -13,44 +14,127 @@ from tqdm import tqdm
 # --- CONFIGURATION ---
 DATA_DIR = Path(__file__).parent.parent / 'data'
 INPUT_FILE = DATA_DIR / 'enriched_library.csv'
+INPUT_PARQUET_FILE = DATA_DIR / 'enriched_library.parquet'  # Typed copy written by enrich_data.py
 OUTPUT_FILE = DATA_DIR / 'library_with_embeddings.json'
+# Binary copies for Python consumers (the frontend keeps reading OUTPUT_FILE)
+EMBEDDINGS_FILE = DATA_DIR / 'library_embeddings.npy'  # int8 unit vectors; row i belongs to EMBEDDING_IDS_FILE[i]
+EMBEDDING_NORMS_FILE = DATA_DIR / 'library_embedding_norms.npy'  # fp16 L2 norm per row
+EMBEDDING_IDS_FILE = DATA_DIR / 'library_embedding_ids.json'
+LIBRARY_PARQUET_FILE = DATA_DIR / 'library.parquet'  # Book metadata, no vectors; embedding_row indexes EMBEDDINGS_FILE
 MODEL_NAME = 'all-MiniLM-L6-v2'
+ENCODE_BATCH_SIZE = 256  # MiniLM-L6 is small; big batches amortize per-batch overhead
 
-def create_embedding_text(row):
+def parse_genres(genres_str):
+    """Parse a genres string like "['Fantasy', 'Fiction']" to a list.
+    
+    A list of plain strings is valid JSON once its quotes are swapped, and json.loads
+    is much faster than ast; strings with quotes or escapes inside, or anything that
+    doesn't come back as a list of strings, go through ast.literal_eval as before.
+    """
+    if '"' not in genres_str and '\\' not in genres_str:
+        try:
+            genres = json.loads(genres_str.replace("'", '"'))
+            if isinstance(genres, list) and all(isinstance(g, str) for g in genres):
+                return genres
+        except ValueError:
+            pass
+    return ast.literal_eval(genres_str)
+
+def format_genres(genres):
+    """'Genres: a, b, ...' for a genres list (or its string form), top 5; None if none/unparseable."""
+    try:
+        genres = parse_genres(genres) if isinstance(genres, str) else genres
+        if genres:
+            return f"Genres: {', '.join(genres[:5])}"
+    except:
+        pass
+    return None
+
+def create_embedding_texts(df):
     """
-    Creates rich text for embedding by combining multiple fields.
+    Creates rich text for embedding by combining multiple fields, for all rows at once.
     This gives the embedding more semantic context than description alone.
+    Optional parts are appended as ' | <part>' only where present.
     """
-    parts = []
+    def present(col):
+        if col not in df:
+            return pd.Series(False, index=df.index)
+        return df[col].notna() & df[col].astype(bool)
     
     # Title and author (always present)
-    parts.append(f"Title: {row['Title']}")
-    parts.append(f"Author: {row['Author']}")
+    texts = 'Title: ' + df['Title'].astype(str) + ' | Author: ' + df['Author'].astype(str)
     
     # Series if available
-    if pd.notna(row.get('series')) and row['series']:
-        parts.append(f"Series: {row['series']}")
-    
-    # Description (main content)
-    if pd.notna(row.get('description')) and row['description']:
-        # Truncate very long descriptions to ~500 words
-        desc = str(row['description'])
-        words = desc.split()
-        if len(words) > 500:
-            desc = ' '.join(words[:500]) + '...'
-        parts.append(f"Description: {desc}")
-    
-    # Genres
-    if pd.notna(row.get('genres')) and row['genres']:
-        try:
-            import ast
-            genres = ast.literal_eval(row['genres']) if isinstance(row['genres'], str) else row['genres']
-            if genres:
-                parts.append(f"Genres: {', '.join(genres[:5])}")  # Top 5 genres
-        except:
-            pass
+    if 'series' in df:
+        texts += (' | Series: ' + df['series'].astype(str)).where(present('series'), '')
+    
+    # Description (main content), very long ones truncated to ~500 words.
+    # 501 words take at least 1001 characters, so only longer texts get split
+    if 'description' in df:
+        desc = df['description'].astype(str)
+        maybe_long = (desc.str.len() > 1000).to_numpy()
+        words = desc[maybe_long].str.split(n=500)  # 501 parts <=> more than 500 words
+        too_long = (words.str.len() > 500).to_numpy(dtype=bool)
+        if too_long.any():
+            desc.iloc[np.flatnonzero(maybe_long)[too_long]] = (words[too_long].str[:500].str.join(' ') + '...').to_numpy()
+        texts += (' | Description: ' + desc).where(present('description'), '')
+    
+    # Genres (top 5)
+    if 'genres' in df:
+        genres = df['genres'].where(present('genres')).map(format_genres, na_action='ignore').astype(object)
+        texts += (' | ' + genres).fillna('')
+    
+    return texts
+
+def column_or(df, col, default, cast=None):
+    """A column as a list of Python values, missing entries (or a missing column) -> default."""
+    if col not in df:
+        return [default] * len(df)
+    values = df[col].tolist()
+    if cast is None:
+        return [default if pd.isna(v) else v for v in values]
+    return [default if pd.isna(v) else cast(v) for v in values]
+
+def book_columns(df, default_ids):
+    """Per-book output fields (everything but the embedding), one list per field."""
+    return {
+        'id': [str(v) for v in df['Book Id'].tolist()] if 'Book Id' in df else default_ids,
+        'title': df['Title'].tolist(),
+        'author': df['Author'].tolist(),
+        'my_rating': column_or(df, 'My Rating', 0, int),
+        'avg_rating': column_or(df, 'Average Rating', 0, float),
+        'shelf': column_or(df, 'Exclusive Shelf', 'unknown'),
+        'date_read': column_or(df, 'Date Read', None),
+        'date_added': column_or(df, 'Date Added', None),
+        'pages': column_or(df, 'Number of Pages', None, int),
+        'year_published': column_or(df, 'Year Published', None, int),
+        'description': df['description'].tolist(),
+        'genres': column_or(df, 'genres', '[]'),
+        'cover_url': column_or(df, 'coverImg', None),
+        'series': column_or(df, 'series', None),
+        'review': column_or(df, 'My Review', None),
+    }
+
+def quantize_embeddings(matrix):
+    """Quantize embeddings to int8 unit vectors plus fp16 norms (~4x smaller than fp32).
     
-    return " | ".join(parts)
+    Dequantize with: q.astype(np.float32) / 127 * norms[:, None]
+    """
+    norms = np.linalg.norm(matrix, axis=1)
+    unit = matrix / np.where(norms > 0, norms, 1)[:, None]
+    q = np.round(unit * 127).astype(np.int8)
+    return q, norms.astype(np.float16)
+
+def load_enriched_library():
+    """Read the enriched library, preferring the Parquet copy when it isn't older than the CSV.
+    
+    Returns (df, path read from).
+    """
+    if INPUT_PARQUET_FILE.exists() and (
+        not INPUT_FILE.exists() or INPUT_PARQUET_FILE.stat().st_mtime >= INPUT_FILE.stat().st_mtime
+    ):
+        return pd.read_parquet(INPUT_PARQUET_FILE), INPUT_PARQUET_FILE
+    return pd.read_csv(INPUT_FILE), INPUT_FILE
 
 def run_pipeline():
     print("=" * 60)
@@ -59,8 +143,8 @@ def run_pipeline():
     
     # Load enriched data
     print(f"\n[1/4] Loading enriched library...")
-    df = pd.read_csv(INPUT_FILE)
-    print(f"   ✓ Loaded {len(df)} books")
+    df, source = load_enriched_library()
+    print(f"   ✓ Loaded {len(df)} books from {source.name}")
     
     # Filter to books with descriptions (can't embed empty text)
     df_with_desc = df[df['description'].notna()].copy()
@@ -68,14 +152,18 @@ def run_pipeline():
     
     # Load model
     print(f"\n[2/4] Loading Sentence Transformer model: {MODEL_NAME}")
+    import torch
     from sentence_transformers import SentenceTransformer
-    model = SentenceTransformer(MODEL_NAME)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    model = SentenceTransformer(MODEL_NAME, device=device)
+    if device == 'cuda':
+        model.half()  # fp16 inference on GPU
     embedding_dim = model.get_sentence_embedding_dimension()
-    print(f"   ✓ Model loaded (embedding dimension: {embedding_dim})")
+    print(f"   ✓ Model loaded on {device} (embedding dimension: {embedding_dim})")
     
     # Generate embedding texts
     print(f"\n[3/4] Creating embedding texts...")
-    df_with_desc['embedding_text'] = df_with_desc.apply(create_embedding_text, axis=1)
+    df_with_desc['embedding_text'] = create_embedding_texts(df_with_desc)
     texts = df_with_desc['embedding_text'].tolist()
     print(f"   ✓ Prepared {len(texts)} texts for embedding")
     
@@ -83,67 +171,61 @@ def run_pipeline():
     print(f"\n[4/4] Generating embeddings...")
     print(f"   (This may take a few minutes for {len(texts)} books)")
     
-    # Batch encode for efficiency
-    embeddings = model.encode(
-        texts,
-        batch_size=32,
-        show_progress_bar=True,
-        convert_to_numpy=True
-    )
+    # Batch encode for efficiency; unit-normalized, so cosine similarity downstream
+    # is a plain dot product
+    if texts:
+        embeddings = model.encode(
+            texts,
+            batch_size=ENCODE_BATCH_SIZE,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    else:
+        embeddings = np.empty((0, embedding_dim), np.float32)
     
     print(f"   ✓ Generated {len(embeddings)} embeddings")
     
-    # Prepare output data
-    output_data = []
-    for idx, (_, row) in enumerate(df_with_desc.iterrows()):
-        book_data = {
-            'id': str(row.get('Book Id', idx)),
-            'title': row['Title'],
-            'author': row['Author'],
-            'my_rating': int(row['My Rating']) if pd.notna(row['My Rating']) else 0,
-            'avg_rating': float(row['Average Rating']) if pd.notna(row['Average Rating']) else 0,
-            'shelf': row['Exclusive Shelf'] if pd.notna(row['Exclusive Shelf']) else 'unknown',
-            'date_read': row['Date Read'] if pd.notna(row['Date Read']) else None,
-            'date_added': row['Date Added'] if pd.notna(row['Date Added']) else None,
-            'pages': int(row['Number of Pages']) if pd.notna(row['Number of Pages']) else None,
-            'year_published': int(row['Year Published']) if pd.notna(row['Year Published']) else None,
-            'description': row['description'],
-            'genres': row['genres'] if pd.notna(row['genres']) else '[]',
-            'cover_url': row['coverImg'] if pd.notna(row['coverImg']) else None,
-            'series': row['series'] if pd.notna(row['series']) else None,
-            'review': row['My Review'] if pd.notna(row.get('My Review')) else None,
-            'embedding': embeddings[idx].tolist(),
-            'embedding_text': row['embedding_text']
-        }
-        output_data.append(book_data)
+    # Prepare output data column by column: books with embeddings first (row i <-> embeddings[i])
+    columns = book_columns(df_with_desc, default_ids=[str(i) for i in range(len(df_with_desc))])
+    columns['embedding'] = embeddings.tolist()
+    columns['embedding_text'] = df_with_desc['embedding_text'].tolist()
     
     # Also include books WITHOUT descriptions (but no embedding)
     df_no_desc = df[df['description'].isna()]
-    for _, row in df_no_desc.iterrows():
-        book_data = {
-            'id': str(row.get('Book Id', '')),
-            'title': row['Title'],
-            'author': row['Author'],
-            'my_rating': int(row['My Rating']) if pd.notna(row['My Rating']) else 0,
-            'avg_rating': float(row['Average Rating']) if pd.notna(row['Average Rating']) else 0,
-            'shelf': row['Exclusive Shelf'] if pd.notna(row['Exclusive Shelf']) else 'unknown',
-            'date_read': row['Date Read'] if pd.notna(row['Date Read']) else None,
-            'date_added': row['Date Added'] if pd.notna(row['Date Added']) else None,
-            'pages': int(row['Number of Pages']) if pd.notna(row['Number of Pages']) else None,
-            'year_published': int(row['Year Published']) if pd.notna(row['Year Published']) else None,
-            'description': None,
-            'genres': '[]',
-            'cover_url': None,
-            'series': None,
-            'review': row['My Review'] if pd.notna(row.get('My Review')) else None,
-            'embedding': None,  # No embedding for books without descriptions
-            'embedding_text': None
-        }
-        output_data.append(book_data)
+    no_desc = [None] * len(df_no_desc)
+    no_desc_columns = book_columns(df_no_desc, default_ids=[''] * len(df_no_desc))
+    no_desc_columns.update(
+        description=no_desc,
+        genres=['[]'] * len(df_no_desc),
+        cover_url=no_desc,
+        series=no_desc,
+        embedding=no_desc,  # No embedding for books without descriptions
+        embedding_text=no_desc
+    )
+    
+    keys = tuple(columns)
+    output_data = [dict(zip(keys, row)) for row in zip(*columns.values())]
+    output_data += [dict(zip(keys, row)) for row in zip(*no_desc_columns.values())]
     
     # Save to JSON
     with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, indent=2)
+        json.dump(output_data, f)
+    
+    # Binary sidecar + columnar metadata, written after the JSON so readers can tell
+    # they are at least as fresh as it
+    q, norms = quantize_embeddings(np.asarray(embeddings, dtype=np.float32))
+    np.save(EMBEDDINGS_FILE, q)
+    np.save(EMBEDDING_NORMS_FILE, norms)
+    with open(EMBEDDING_IDS_FILE, 'w', encoding='utf-8') as f:
+        json.dump(columns['id'], f)
+    metadata = pd.DataFrame(output_data, columns=[k for k in keys if k != 'embedding'])
+    metadata['embedding_row'] = pd.array(
+        list(range(len(df_with_desc))) + [None] * len(df_no_desc), dtype='Int64'
+    )
+    metadata.astype({'pages': 'Int64', 'year_published': 'Int64'}).to_parquet(
+        LIBRARY_PARQUET_FILE, engine='pyarrow', compression='zstd', index=False
+    )
     
     # Stats
     books_with_embeddings = len([b for b in output_data if b['embedding'] is not None])
@@ -158,6 +240,8 @@ def run_pipeline():
     print(f"   • Embedding model:    {MODEL_NAME}")
     print(f"   • Embedding dimension: {embedding_dim}")
     print(f"\n📁 Output saved to: {OUTPUT_FILE}")
+    print(f"📁 Embedding matrix saved to: {EMBEDDINGS_FILE}")
+    print(f"📁 Metadata saved to: {LIBRARY_PARQUET_FILE}")
     
     return output_data
 
@@ -5,9 +5,11 @@ Generates static JSON data for charts and 3D Galaxy View coordinates.
 """
 import json
 import numpy as np
+import orjson
 import pandas as pd
 from pathlib import Path
 from collections import Counter
+from itertools import chain
 from datetime import datetime
 import ast
 
@@ -16,29 +18,78 @@ DATA_DIR = Path(__file__).parent.parent / 'data'
 INPUT_FILE = DATA_DIR / 'library_with_embeddings.json'
 OUTPUT_FILE = DATA_DIR / 'analytics_data.json'
 GALAXY_OUTPUT = DATA_DIR / 'galaxy_coordinates.json'
+ANALYTICS_COLUMNS = ['shelf', 'date_read', 'genres', 'my_rating', 'author']
+GALAXY_META_COLUMNS = ['id', 'title', 'author', 'my_rating', 'shelf', 'cover_url', 'genres', 'pages']
+UMAP_EXACT_KNN_LIMIT = 4096  # UMAP computes exact neighbors below this many points
+# Binary copies written by generate_embeddings.py (see load_library)
+LIBRARY_PARQUET_FILE = DATA_DIR / 'library.parquet'
+EMBEDDINGS_FILE = DATA_DIR / 'library_embeddings.npy'
+EMBEDDING_NORMS_FILE = DATA_DIR / 'library_embedding_norms.npy'
 
 def parse_genres(genres_str):
-    """Parse genres string to list."""
+    """Parse a genres string like "['Fantasy', 'Fiction']" to a list.
+    
+    A list of plain strings is valid JSON once its quotes are swapped, and json.loads
+    is much faster than ast; strings with quotes or escapes inside, or anything that
+    doesn't come back as a list of strings, go through ast.literal_eval as before.
+    """
     if not genres_str or genres_str == '[]':
         return []
+    if isinstance(genres_str, str) and '"' not in genres_str and '\\' not in genres_str:
+        try:
+            genres = json.loads(genres_str.replace("'", '"'))
+            if isinstance(genres, list) and all(isinstance(g, str) for g in genres):
+                return genres
+        except ValueError:
+            pass
     try:
         return ast.literal_eval(genres_str)
     except:
         return []
 
-def parse_date(date_str):
-    """Parse date string to datetime object."""
-    if not date_str:
-        return None
-    try:
-        # Format: 2025/12/28
-        return datetime.strptime(date_str, '%Y/%m/%d')
-    except:
-        try:
-            # Try alternate formats
-            return datetime.strptime(date_str, '%Y-%m-%d')
-        except:
-            return None
+def parse_dates(s):
+    """Vectorized date parsing: 2025/12/28 or 2025-12-28, NaT for anything else."""
+    dates = pd.to_datetime(s, format='%Y/%m/%d', errors='coerce')
+    return dates.fillna(pd.to_datetime(s, format='%Y-%m-%d', errors='coerce'))
+
+def normalize_coords(coords):
+    """Scale each column to [-1, 1] in one pass; constant columns are left as is."""
+    min_val, max_val = coords.min(axis=0), coords.max(axis=0)
+    spread = np.where(max_val > min_val, max_val - min_val, 1)
+    return np.where(max_val > min_val, 2 * (coords - min_val) / spread - 1, coords)
+
+def sidecar_is_fresh():
+    """True when library.parquet and the embeddings sidecar exist and aren't older than the JSON."""
+    sidecar_files = (LIBRARY_PARQUET_FILE, EMBEDDINGS_FILE, EMBEDDING_NORMS_FILE)
+    if not all(path.exists() for path in sidecar_files):
+        return False
+    return LIBRARY_PARQUET_FILE.stat().st_mtime >= INPUT_FILE.stat().st_mtime
+
+def load_library(source):
+    """Load the books plus the UMAP input for the ones with embeddings.
+    
+    Returns (books, books_with_embeddings, embeddings). Books carry no vectors
+    when read from library.parquet; the int8 sidecar is dequantized instead of
+    parsing millions of floats out of the JSON.
+    """
+    if source == LIBRARY_PARQUET_FILE:
+        metadata = pd.read_parquet(LIBRARY_PARQUET_FILE)
+        embedding_row = metadata.pop('embedding_row')
+        books = metadata.astype(object).where(metadata.notna(), None).to_dict(orient='records')
+        has_embedding = embedding_row.notna().to_numpy()
+        rows = embedding_row[has_embedding].to_numpy(dtype=np.int64)
+        q = np.load(EMBEDDINGS_FILE, mmap_mode='r')
+        norms = np.load(EMBEDDING_NORMS_FILE, mmap_mode='r')
+        embeddings = q[rows].astype(np.float32) / 127 * norms[rows, None].astype(np.float32)
+        books_with_embeddings = [b for b, keep in zip(books, has_embedding) if keep]
+        return books, books_with_embeddings, embeddings
+    
+    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
+        books = json.load(f)
+    books_with_embeddings = [b for b in books if b.get('embedding') is not None]
+    # float32 is what UMAP works in anyway; skip the float64 intermediate
+    embeddings = np.asarray([b['embedding'] for b in books_with_embeddings], dtype=np.float32)
+    return books, books_with_embeddings, embeddings
 
 def run_pipeline():
     print("=" * 60)
@@ -47,23 +98,24 @@ def run_pipeline():
     
     # Load data
     print(f"\n[1/5] Loading library data...")
-    with open(INPUT_FILE, 'r', encoding='utf-8') as f:
-        books = json.load(f)
-    print(f"   ✓ Loaded {len(books)} books")
+    source = LIBRARY_PARQUET_FILE if sidecar_is_fresh() else INPUT_FILE
+    books, books_with_embeddings, embeddings = load_library(source)
+    print(f"   ✓ Loaded {len(books)} books from {source.name}")
     
-    # Convert to DataFrame for easier analysis
-    df = pd.DataFrame(books)
+    # Convert to DataFrame for easier analysis (only the chart columns, never the embeddings)
+    df = pd.DataFrame(books, columns=ANALYTICS_COLUMNS)
+    # shelf is filtered on over and over; compare category codes instead of strings.
+    # Categories in first-seen order keep value_counts ties in the same order as before
+    df['shelf'] = pd.Categorical(df['shelf'], categories=df['shelf'].dropna().unique())
     
     # --- CHART 1: Reading Timeline ---
     print(f"\n[2/5] Computing reading timeline...")
     read_books = df[(df['shelf'] == 'read') & (df['date_read'].notna())].copy()
-    read_books['date_parsed'] = read_books['date_read'].apply(parse_date)
-    read_books = read_books[read_books['date_parsed'].notna()]
+    read_books['date_parsed'] = parse_dates(read_books['date_read'])
+    read_books = read_books.dropna(subset=['date_parsed'])
     
     if len(read_books) > 0:
-        read_books['year_month'] = read_books['date_parsed'].apply(
-            lambda x: x.strftime('%Y-%m') if x else None
-        )
+        read_books['year_month'] = read_books['date_parsed'].dt.strftime('%Y-%m')
         timeline = read_books.groupby('year_month').size().reset_index(name='count')
         timeline = timeline.sort_values('year_month')
         reading_timeline = timeline.to_dict(orient='records')
@@ -73,12 +125,8 @@ def run_pipeline():
     
     # --- CHART 2: Genre Breakdown ---
     print(f"\n[3/5] Computing genre breakdown...")
-    all_genres = []
-    for genres_str in df['genres']:
-        genres = parse_genres(genres_str)
-        all_genres.extend(genres[:3])  # Top 3 genres per book
-    
-    genre_counts = Counter(all_genres)
+    # Top 3 genres per book, counted straight from the parsed lists
+    genre_counts = Counter(chain.from_iterable(parse_genres(g)[:3] for g in df['genres'].tolist()))
     top_genres = genre_counts.most_common(12)
     genre_breakdown = [{'genre': g, 'count': c} for g, c in top_genres]
     print(f"   ✓ Found {len(genre_counts)} unique genres, showing top 12")
@@ -96,12 +144,23 @@ def run_pipeline():
     
     # --- GALAXY VIEW: 3D Coordinates via UMAP ---
     print(f"\n[5/5] Computing 3D coordinates for Galaxy View...")
-    books_with_embeddings = [b for b in books if b.get('embedding') is not None]
-    
     if len(books_with_embeddings) > 10:
         import umap
+        from umap.umap_ import nearest_neighbors
         
-        embeddings = np.array([b['embedding'] for b in books_with_embeddings])
+        # Past UMAP_EXACT_KNN_LIMIT books UMAP approximates the k-NN graph with
+        # NN-descent; build that once and share it between the 3D and 2D reducers.
+        # Below it UMAP's exact pairwise path is cheaper than compiling NN-descent.
+        knn = (None, None, None)
+        if len(embeddings) >= UMAP_EXACT_KNN_LIMIT:
+            knn = nearest_neighbors(
+                embeddings,
+                n_neighbors=15,
+                metric='cosine',
+                metric_kwds=None,
+                angular=True,
+                random_state=np.random.RandomState(42)
+            )
         
         # UMAP to 3D
         reducer = umap.UMAP(
@@ -109,16 +168,13 @@ def run_pipeline():
             n_neighbors=15,
             min_dist=0.1,
             metric='cosine',
-            random_state=42
+            random_state=42,
+            precomputed_knn=knn
         )
         coords_3d = reducer.fit_transform(embeddings)
         
         # Normalize to [-1, 1] range for Three.js
-        for dim in range(3):
-            min_val = coords_3d[:, dim].min()
-            max_val = coords_3d[:, dim].max()
-            if max_val > min_val:
-                coords_3d[:, dim] = 2 * (coords_3d[:, dim] - min_val) / (max_val - min_val) - 1
+        coords_3d = normalize_coords(coords_3d)
         
         # Also compute 2D for fallback
         reducer_2d = umap.UMAP(
@@ -126,34 +182,21 @@ def run_pipeline():
             n_neighbors=15,
             min_dist=0.1,
             metric='cosine',
-            random_state=42
+            random_state=42,
+            precomputed_knn=knn
         )
         coords_2d = reducer_2d.fit_transform(embeddings)
         
         # Normalize 2D
-        for dim in range(2):
-            min_val = coords_2d[:, dim].min()
-            max_val = coords_2d[:, dim].max()
-            if max_val > min_val:
-                coords_2d[:, dim] = 2 * (coords_2d[:, dim] - min_val) / (max_val - min_val) - 1
+        coords_2d = normalize_coords(coords_2d)
         
-        galaxy_data = []
-        for i, book in enumerate(books_with_embeddings):
-            galaxy_data.append({
-                'id': book['id'],
-                'title': book['title'],
-                'author': book['author'],
-                'my_rating': book['my_rating'],
-                'shelf': book['shelf'],
-                'cover_url': book['cover_url'],
-                'genres': parse_genres(book['genres'])[:3],
-                'pages': book['pages'],
-                'x': float(coords_3d[i, 0]),
-                'y': float(coords_3d[i, 1]),
-                'z': float(coords_3d[i, 2]),
-                'x2d': float(coords_2d[i, 0]),
-                'y2d': float(coords_2d[i, 1])
-            })
+        # Metadata columns for every book at once, then the coordinates as whole columns
+        meta = pd.DataFrame(books_with_embeddings, columns=GALAXY_META_COLUMNS, dtype=object)
+        meta = meta.where(meta.notna(), None)
+        meta['genres'] = [parse_genres(g)[:3] for g in meta['genres']]
+        meta[['x', 'y', 'z']] = coords_3d
+        meta[['x2d', 'y2d']] = coords_2d
+        galaxy_data = meta.to_dict(orient='records')
         print(f"   ✓ Generated 3D coordinates for {len(galaxy_data)} books")
     else:
         galaxy_data = []
@@ -193,13 +236,11 @@ def run_pipeline():
         'shelf_summary': shelf_summary
     }
     
-    # Save analytics
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(analytics, f, indent=2)
+    # Save analytics (small, kept human-readable)
+    OUTPUT_FILE.write_bytes(orjson.dumps(analytics, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY))
     
-    # Save galaxy data separately (larger file)
-    with open(GALAXY_OUTPUT, 'w', encoding='utf-8') as f:
-        json.dump(galaxy_data, f, indent=2)
+    # Save galaxy data separately (larger file, compact; numpy coordinates serialize as-is)
+    GALAXY_OUTPUT.write_bytes(orjson.dumps(galaxy_data, option=orjson.OPT_SERIALIZE_NUMPY))
     
     print("\n" + "=" * 60)
     print("✅ Analytics Pre-computation Complete!")